@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+# Collect eBPF timings across nodes. Each node runs an agent that runs the
+# collector (time-calls.py) locally, aggregates the result, and sends a compact
+# per-function summary to a coordinator over a socket. The coordinator merges
+# them into one run record.
+#
+# Usage (coordinator, on the launch node):
+#   python3 collect-nodes.py coordinator --port 5555 --nodes 4
+#
+# Usage (agent, on each node):
+#   sudo -E python3 collect-nodes.py agent --coordinator head:5555 --wait-for prted \
+#     python3 time-calls.py --pattern do_sys*
+#
+# Or start an agent on each host in a hostfile (over ssh):
+#   python3 collect-nodes.py launch --hostfile ./hostfile.txt --coordinator head:5555 \
+#     python3 time-calls.py --pattern do_sys*
+
+import argparse
+import json
+import os
+import shlex
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+
+from collector import summarize_ranks
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Collect eBPF function times across nodes",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = subparsers.add_parser(
+        "coordinator", help="receive node summaries and merge into a run record"
+    )
+    coordinator.add_argument("--host", help="address to listen on", default="0.0.0.0")
+    coordinator.add_argument("--port", help="port to listen on", type=int, default=5555)
+    coordinator.add_argument(
+        "--nodes", help="number of agents to wait for", type=int, required=True
+    )
+    coordinator.add_argument(
+        "--timeout",
+        help="seconds to wait for all agents before merging what we have",
+        type=int,
+        default=3600,
+    )
+    coordinator.add_argument("--out", help="write the merged run record to this file")
+
+    agent = subparsers.add_parser(
+        "agent", help="run the collector on this node and send a summary"
+    )
+    agent.add_argument(
+        "--coordinator", help="host:port of the coordinator", required=True
+    )
+    agent.add_argument("--node", help="name of this node", default=socket.gethostname())
+    agent.add_argument(
+        "--wait-for",
+        dest="wait_for",
+        help="wait for a process by name and pass it to the collector as --pid",
+    )
+
+    launch = subparsers.add_parser(
+        "launch", help="start an agent on each host in a hostfile over ssh"
+    )
+    launch.add_argument("--hostfile", help="MPI hostfile", required=True)
+    launch.add_argument(
+        "--coordinator", help="host:port of the coordinator", required=True
+    )
+    launch.add_argument(
+        "--wait-for",
+        dest="wait_for",
+        help="wait for a process by name and pass it to the collector as --pid",
+    )
+    return parser
+
+
+def get_block(text, name):
+    """
+    Get a json block (e.g., === RESULTS START / END) from collector output.
+    """
+    start = f"=== {name} START"
+    end = f"=== {name} END"
+    if start not in text:
+        return None
+    return json.loads(text.split(start, 1)[-1].split(end, 1)[0])
+
+
+def read_hostfile(filename):
+    """
+    Read hosts from an MPI hostfile (e.g., "node-0 slots=56" or "node-0:56")
+    """
+    hosts = []
+    with open(filename) as fd:
+        for line in fd.readlines():
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            host = line.split()[0].split(":")[0]
+            if host not in hosts:
+                hosts.append(host)
+    return hosts
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def get_pid(name, interval=0.5):
+    """
+    Wait for a process by name to exist, and return the first pid.
+    """
+    while True:
+        try:
+            pid = subprocess.check_output(["pidof", "-s", name])
+            return int(pid.decode("utf-8").strip())
+        except subprocess.CalledProcessError:
+            time.sleep(interval)
+
+
+def summarize(node, returncode, output):
+    """
+    Aggregate collector output into a compact per-function summary.
+
+    We keep count and time per function, and the time per rank so the
+    coordinator can merge rank distributions across nodes exactly.
+    """
+    results = get_block(output, "RESULTS") or []
+    ranks = get_block(output, "RANKS") or []
+
+    functions = {}
+    for result in results:
+        functions[result["func"]] = {
+            "count": result["count"],
+            "time_nsecs": result["time_nsecs"],
+            "ranks": {},
+        }
+
+    # Processes without a rank (e.g., mpirun or prted) count toward the
+    # totals but are not part of the rank distribution
+    for row in ranks:
+        if row["rank"] is None or row["func"] not in functions:
+            continue
+        key = str(row["rank"])
+        func = functions[row["func"]]
+        func["ranks"][key] = func["ranks"].get(key, 0) + row["time_nsecs"]
+
+    return {"node": node, "returncode": returncode, "functions": functions}
+
+
+def send_summary(address, summary, retries=30, interval=2):
+    """
+    Send a summary to the coordinator as one line of json.
+    """
+    host, port = parse_address(address)
+    payload = (json.dumps(summary) + "\n").encode("utf-8")
+    for attempt in range(retries):
+        try:
+            with socket.create_connection((host, port), timeout=30) as conn:
+                conn.sendall(payload)
+            return
+        except OSError as e:
+            print(f"Cannot reach coordinator {address} ({e}), retrying...")
+            time.sleep(interval)
+    sys.exit(f"Could not send summary to coordinator {address}")
+
+
+def stream_blocks(p):
+    """
+    Stream collector output to the terminal, and keep only the json blocks.
+
+    The application output can be huge, and we only need the blocks to
+    summarize, so memory does not grow with a chatty run.
+    """
+    blocks = []
+    in_block = False
+    for line in iter(p.stdout.readline, b""):
+        line = line.decode("utf-8", errors="replace")
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        if line.startswith("=== ") and line.rstrip().endswith(" START"):
+            in_block = True
+        if in_block:
+            blocks.append(line)
+        if line.startswith("=== ") and line.rstrip().endswith(" END"):
+            in_block = False
+    return p.wait(), "".join(blocks)
+
+
+def run_agent(args, command):
+    """
+    Run the collector on this node, summarize, and ship it.
+    """
+    if not command:
+        sys.exit("We need a collector command for the agent to run.")
+
+    if args.wait_for:
+        pid = get_pid(args.wait_for)
+        print(f"Found {args.wait_for} with pid {pid}")
+        command = command + ["--pid", str(pid)]
+
+    print(f"👀️ Running collector on {args.node}: {' '.join(command)}")
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    returncode, output = stream_blocks(p)
+
+    summary = summarize(args.node, returncode, output)
+    print(f"Sending {len(summary['functions'])} functions to {args.coordinator}")
+    send_summary(args.coordinator, summary)
+
+
+def merge(summaries):
+    """
+    Merge node summaries into one run record.
+
+    Results are totals across nodes (same format as time-calls.py) with a
+    per-rank summary, and we keep the per-node breakdown too.
+    """
+    totals = {}
+    for summary in summaries:
+        for func, values in summary["functions"].items():
+            if func not in totals:
+                totals[func] = {"func": func, "count": 0, "time_nsecs": 0, "ranks": {}}
+            totals[func]["count"] += values["count"]
+            totals[func]["time_nsecs"] += values["time_nsecs"]
+
+            # Agents on one machine (for testing) all have ranks from 0
+            for rank, time_nsecs in values["ranks"].items():
+                totals[func]["ranks"][(summary["node"], rank)] = time_nsecs
+
+    results = []
+    for func, total in totals.items():
+        total["per_rank"] = summarize_ranks(list(total.pop("ranks").values()))
+        results.append(total)
+
+    return {
+        "nodes": {
+            s["node"]: {
+                "returncode": s["returncode"],
+                "functions": len(s["functions"]),
+                "time_nsecs": sum(v["time_nsecs"] for v in s["functions"].values()),
+            }
+            for s in summaries
+        },
+        "results": results,
+    }
+
+
+def run_coordinator(args):
+    """
+    Wait for summaries from agents, then merge them.
+    """
+    summaries = []
+
+    class SummaryHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            try:
+                summary = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Bad summary from {self.client_address[0]}, skipping.")
+                return
+            summaries.append(summary)
+            print(
+                f"Received {summary['node']} ({len(summaries)} of {args.nodes} nodes)"
+            )
+
+    socketserver.TCPServer.allow_reuse_address = True
+    with socketserver.TCPServer((args.host, args.port), SummaryHandler) as server:
+        print(f"Waiting for {args.nodes} agents on {args.host}:{args.port}...")
+        deadline = time.time() + args.timeout
+        while len(summaries) < args.nodes and time.time() < deadline:
+            server.timeout = max(deadline - time.time(), 0)
+            server.handle_request()
+
+    if len(summaries) < args.nodes:
+        print(f"Warning: only {len(summaries)} of {args.nodes} agents reported.")
+
+    record = merge(summaries)
+    print("%-36s %8s %16s %6s" % ("FUNC", "COUNT", "TIME (nsecs)", "RANKS"))
+    for result in record["results"]:
+        # No ranked process called it (e.g., only the launcher)
+        ranks = (result["per_rank"] or {}).get("n", 0)
+        print(
+            "%-36s %8s %16s %6s"
+            % (result["func"], result["count"], result["time_nsecs"], ranks)
+        )
+
+    # Same format as time-calls.py so the plotting can parse it
+    print("\n=== RESULTS START")
+    print(json.dumps(record["results"]))
+    print("=== RESULTS END")
+    print("\n=== NODES START")
+    print(json.dumps(record["nodes"]))
+    print("=== NODES END")
+
+    if args.out:
+        with open(args.out, "w") as fd:
+            fd.write(json.dumps(record, indent=4))
+
+
+def run_launch(args, command):
+    """
+    Start an agent on each host in the hostfile over ssh.
+    """
+    if not command:
+        sys.exit("We need a collector command for the agents to run.")
+    script = os.path.abspath(__file__)
+    procs = []
+    for host in read_hostfile(args.hostfile):
+        remote = [
+            "python3",
+            script,
+            "agent",
+            "--coordinator",
+            args.coordinator,
+            "--node",
+            host,
+        ]
+        if args.wait_for:
+            remote += ["--wait-for", args.wait_for]
+        remote += command
+        print(f"Starting agent on {host}")
+        procs.append(
+            subprocess.Popen(["ssh", host, "cd", here, "&&", shlex.join(remote)])
+        )
+    for p in procs:
+        p.wait()
+
+
+def main():
+    parser = get_parser()
+    args, command = parser.parse_known_args()
+    if args.command == "coordinator":
+        run_coordinator(args)
+    elif args.command == "agent":
+        run_agent(args, command)
+    elif args.command == "launch":
+        run_launch(args, command)
+
+
+if __name__ == "__main__":
+    main()
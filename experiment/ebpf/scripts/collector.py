@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Shared by time-calls.py (the collector) and the scripts that work with its
+# output (e.g., collect-nodes.py). There is no bcc here, so it can be imported
+# on a node (or coordinator) that does not have it.
+
+import statistics
+
+# Where time-calls.py pins (--pin), a directory per run
+pin_root = "/sys/fs/bpf/time-calls"
+
+# Environment variables that MPI launchers use to tell a process its rank
+rank_envars = ["OMPI_COMM_WORLD_RANK", "PMI_RANK"]
+
+# Structs for the tables we pin. time-calls.py puts these in its program,
+# and read-pinned.py declares the pinned tables with them.
+stats_structs = """
+// Stats are keyed by process (tgid) AND function, so each MPI rank
+// gets its own row instead of all ranks collapsing into one
+struct key_t {
+    u32 tgid;
+    u64 ip;
+};
+
+struct stats_t {
+    u64 time;
+    u64 freq;
+};
+"""
+
+mpi_structs = """
+struct mpi_key_t {
+    u32 tgid;
+    u32 id;
+};
+"""
+
+isolation_structs = """
+struct iso_key_t {
+    u32 tgid;
+    u32 mechanism;
+    u64 ip;
+};
+"""
+
+# Tables time-calls.py pins (if they are loaded), and how read-pinned.py
+# declares them. The sizes must match the tables in time-calls.py.
+pinned_tables = {
+    "tracked": 'BPF_TABLE_PINNED("hash", u32, u32, tracked, 10240, "%s");',
+    "stats": 'BPF_TABLE_PINNED("hash", struct key_t, struct stats_t, stats, 10240, "%s");',
+    "syscalls": 'BPF_TABLE_PINNED("percpu_array", u32, struct stats_t, syscalls, 1024, "%s");',
+    "mpi_stats": 'BPF_TABLE_PINNED("hash", struct mpi_key_t, struct stats_t, mpi_stats, 10240, "%s");',
+    "iso_stats": 'BPF_TABLE_PINNED("hash", struct iso_key_t, struct stats_t, iso_stats, 10240, "%s");',
+}
+
+
+def get_rank(pid):
+    """
+    Get the MPI rank of a process from its environment.
+
+    The launcher sets the rank in the environment of each process it
+    starts, so we can read it from /proc. This returns None if the
+    process is gone or does not have a rank (e.g., mpirun itself).
+    """
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as fd:
+            environ = fd.read().split(b"\0")
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    for envar in rank_envars:
+        prefix = f"{envar}=".encode("utf-8")
+        for line in environ:
+            if line.startswith(prefix):
+                try:
+                    return int(line[len(prefix) :])
+                except ValueError:
+                    return None
+    return None
+
+
+def summarize_ranks(values):
+    """
+    Summarize the distribution of a function's time across ranks.
+
+    Values are one per rank, and None if no rank called the function.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    mean = sum(values) / len(values)
+    return {
+        "n": len(values),
+        "min": values[0],
+        "median": statistics.median(values),
+        "max": values[-1],
+        "mean": mean,
+        "stdev": statistics.pstdev(values),
+        # Max over mean is a simple measure of imbalance (1.0 is balanced)
+        "imbalance": values[-1] / mean if mean else 0,
+    }
@@ -3,19 +3,94 @@
 import json
 import argparse
 import fnmatch
+import hashlib
+import itertools
+import mmap
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-from scipy import stats
-from statsmodels.sandbox.stats.multicomp import multipletests
+from scipy import special, stats
+import matplotlib
+
+# We only save figures, and the plot workers can't have a display
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import metricsoperator.utils as utils
+import numpy
 import pandas
 import seaborn as sns
-from metricsoperator.metrics.app.lammps import parse_lammps
+from pandas.api.types import union_categoricals
 
 plt.style.use("bmh")
 here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Columns (and types) for application times, one row per run
+# Strings are categories (an integer code per row) to keep campaigns small
+run_columns = {
+    "app": "category",
+    "ranks": "int32",
+    "experiment": "category",
+    "iteration": "int32",
+    "time_seconds": "float64",
+    "nodes": "int16",
+    "percent_cpu_utilization": "float32",
+}
+
+# And for ebpf function times, one row per function per run
+ebpf_columns = dict(run_columns, function="category", count="int64", time_nsecs="int64")
+
+# Runs also get summaries of other time-calls.py blocks (nan if not collected)
+# They are next to wall time, and not repeated on each ebpf row
+block_columns = {
+    "blocked_nsecs": "float64",
+    "preempted_nsecs": "float64",
+    "runq_nsecs": "float64",
+    "startup_nsecs": "float64",
+    "image_pages": "float64",
+    "migrations": "float64",
+    "irq_nsecs": "float64",
+    "softirq_nsecs": "float64",
+    "ticks": "float64",
+}
+run_columns.update(block_columns)
+
+# And figures of merit, one row per figure per run
+fom_columns = {
+    "app": "category",
+    "ranks": "int32",
+    "experiment": "category",
+    "iteration": "int32",
+    "name": "category",
+    "value": "float64",
+}
+
+# Frames we parse results files into (in the order parse_file returns them)
+frame_columns = {"runs": run_columns, "ebpf": ebpf_columns, "foms": fom_columns}
+
+# Numbers in application output (e.g., 56, 0.25, 1.390087e+08)
+number = rb"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+
+# Output parsers by application, see register_parser
+parsers = {}
+
+# Bump this when parsing changes, so cached files are parsed again
+cache_version = 8
+
+# And this when plots change, so they are rendered again
+plot_version = 1
+
+# Each plot worker keeps one figure, and clears it between plots
+figure = None
+
+# Parquet is faster to load, but we don't require pyarrow
+try:
+    import pyarrow  # noqa
+
+    cache_format = "parquet"
+except ImportError:
+    cache_format = "pkl"
+
 
 def get_parser():
     parser = argparse.ArgumentParser(
@@ -32,6 +107,71 @@ def get_parser():
         help="directory to save parsed results",
         default=os.path.join(here, "img"),
     )
+    parser.add_argument(
+        "--workers",
+        help="number of processes to parse results with (defaults to all cpus)",
+        type=int,
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory to cache parsed results (defaults to .parse-cache in --results)",
+    )
+    parser.add_argument(
+        "--app",
+        help="application for results files that don't name one in their path,\nand the one to test and plot when there are several",
+        choices=sorted(parsers),
+        default="lammps",
+    )
+    parser.add_argument(
+        "--test",
+        help="two sample t-test to report as the pvalue (student assumes equal variance)",
+        choices=["student", "welch"],
+        default="student",
+    )
+    parser.add_argument(
+        "--correction",
+        help="multiple testing correction for the pvalue",
+        choices=["bonferroni", "holm", "fdr_bh"],
+        default="bonferroni",
+    )
+    parser.add_argument(
+        "--permutations",
+        help="label permutations for the permutation test (0 to skip non-parametric tests)",
+        type=int,
+        default=10000,
+    )
+    parser.add_argument(
+        "--resamples",
+        help="bootstrap resamples for confidence intervals of the mean difference",
+        type=int,
+        default=10000,
+    )
+    parser.add_argument(
+        "--seed",
+        help="random seed for permutations and bootstrap resamples",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--top",
+        help="functions to show in the overhead waterfall for each size",
+        type=int,
+        default=15,
+    )
+    parser.add_argument(
+        "--plot",
+        help="plots to render (can be used more than once)",
+        choices=["lammps", "ebpf", "distribution", "waterfall"],
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        help="parse all results files, and don't write the cache",
+        action="store_true",
+        default=False,
+    )
     return parser
 
 
@@ -75,279 +215,1541 @@ def main():
 
     # This does the actual parsing of data into a formatted variant
     # Has keys results, iters, and columns
-    df, lammps = parse_data(files)
+    cache = None
+    if not args.no_cache:
+        cache = os.path.abspath(args.cache or os.path.join(indir, ".parse-cache"))
+    df, runs, foms = parse_data(files, args.workers, cache, args.app)
 
     # Show means grouped by experiment to sanity check plots
     df.to_csv(os.path.join(outdir, "testing-times.csv"))
+    runs.to_csv(os.path.join(outdir, "run-times.csv"))
+    foms.to_csv(os.path.join(outdir, "figures-of-merit.csv"))
+    lammps = runs[runs.app == "lammps"]
     lammps.to_csv(os.path.join(outdir, "lammps-times.csv"))
 
+    # The tests and plots are for one application at a time
+    if df.app.nunique() > 1:
+        df = df[df.app == args.app]
+
     # Write unique functions to file
     funcs = df.function.unique().tolist()
     funcs.sort()
     print(f"There are {len(funcs)} relevant ebpf functions")
     utils.write_json(funcs, os.path.join(outdir, "ebpf-functions.json"))
     utils.write_file("\n".join(funcs), os.path.join(outdir, "ebpf-functions.txt"))
-    plot_results(df, lammps, outdir)
 
+    # Where the wall time gap between environments goes, by function
+    attribution = attribute_overhead(df, resamples=args.resamples, seed=args.seed)
+    waterfall = overhead_waterfall(attribution, args.top)
+    attribution.to_csv(os.path.join(outdir, "overhead-attribution.csv"))
+    waterfall.to_csv(os.path.join(outdir, "overhead-waterfall.csv"))
 
-def plot_lammps(lammps, outdir):
+    # Plots are only rendered again if their data changed
+    if "lammps" in args.plot:
+        plot_lammps(lammps, outdir)
+    if "ebpf" in args.plot:
+        plot_ebpf(df, outdir, args.workers)
+    if "distribution" in args.plot:
+        plot_distribution(df, outdir, args.workers)
+    if "waterfall" in args.plot:
+        plot_waterfall(waterfall, outdir, args.workers)
+    plot_results(
+        df,
+        runs,
+        outdir,
+        args.test,
+        args.correction,
+        args.permutations,
+        args.resamples,
+        args.seed,
+    )
+
+
+def get_figure():
     """
-    Plot lammps times
+    Get the figure for this worker, cleared, with one axes.
+    """
+    global figure
+    if figure is None:
+        figure = plt.figure()
+    figure.clf()
+    return figure, figure.add_subplot()
+
+
+def hash_plot(job):
+    """
+    Hash what a plot is made from, so we know if it needs rendering again.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([plot_version, job["kind"], job["args"]]).encode())
+    digest.update(pandas.util.hash_pandas_object(job["data"], index=False).to_numpy())
+    return digest.hexdigest()
+
+
+def render_plot(job):
+    """
+    Render one plot in a worker, reusing the worker figure.
+    """
+    fig, ax = get_figure()
+
+    # A slice can have categories it does not use (they would show in legends)
+    data = job["data"]
+    for name in data.select_dtypes("category"):
+        data[name] = data[name].cat.remove_unused_categories()
+    renderers[job["kind"]](fig, ax, data, **job["args"])
+    fig.savefig(job["path"])
+    return job["path"]
+
+
+def render_plots(jobs, outdir, workers=None):
+    """
+    Render plots in a process pool.
+
+    Plots with the same data as the last render (and still on disk) are skipped.
+    We keep a hash of the data for each plot in render-index.json in outdir.
     """
-    ax = sns.boxplot(
-        data=lammps,
+    index_file = os.path.join(outdir, "render-index.json")
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as fd:
+            index = json.loads(fd.read())
+
+    todo = []
+    for job in jobs:
+        key = os.path.relpath(job["path"], outdir)
+        job["digest"] = hash_plot(job)
+        if index.get(key) == job["digest"] and os.path.exists(job["path"]):
+            continue
+        todo.append(job)
+    print(f"Rendering {len(todo)} plots, {len(jobs) - len(todo)} did not change")
+
+    workers = min(workers or os.cpu_count(), max(len(todo), 1))
+    chunksize = max(1, len(todo) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for i, _ in enumerate(executor.map(render_plot, todo, chunksize=chunksize)):
+            print(f"Rendered {i + 1} of {len(todo)}", end="\r")
+            key = os.path.relpath(todo[i]["path"], outdir)
+            index[key] = todo[i]["digest"]
+    if todo:
+        print()
+    utils.write_json(index, index_file)
+
+
+def draw_lammps(fig, ax, data):
+    sns.boxplot(
+        data=data,
         x="ranks",
         y="time_seconds",
         whis=[5, 95],
         hue="experiment",
         palette="Set2",
+        ax=ax,
     )
-    plt.title("LAMMPS wall-time across sizes with/without eBPF")
+    ax.set_title("LAMMPS wall-time across sizes with/without eBPF")
     ax.set_xlabel("size (ranks)", fontsize=16)
     ax.set_ylabel("Time (seconds)", fontsize=16)
-    ax.set_xticklabels(ax.get_xmajorticklabels(), fontsize=14)
-    ax.set_yticklabels(ax.get_yticks(), fontsize=14)
-    plt.subplots_adjust(left=0.2, bottom=0.2)
-    plt.savefig(os.path.join(outdir, "lammps-times.png"))
-    plt.clf()
-    plt.close()
-
-
-def plot_distribution(singularity, bare_metal, norm_dist_out):
-    sidx = 0
-    histdf = pandas.DataFrame(columns=["experiment", "nanoseconds"])
-    for value in singularity:
-        histdf.loc[sidx] = ["singularity", value]
-        sidx += 1
-    for value in bare_metal:
-        histdf.loc[sidx] = ["bare-metal", value]
-        sidx += 1
-
-    ax = sns.histplot(
-        data=histdf,
-        x="nanoseconds",
+    ax.tick_params(labelsize=14)
+    fig.subplots_adjust(left=0.2, bottom=0.2)
+
+
+def draw_distribution(fig, ax, data, function, size):
+    sns.histplot(
+        data=data,
+        x="time_nsecs",
         hue="experiment",
         palette="Set2",
+        ax=ax,
     )
-    plt.title(f"Distribution times for {function} for size {size}")
+    ax.set_title(f"Distribution times for {function} for size {size}")
     ax.set_xlabel("Time (nanoseconds)", fontsize=16)
-    ax.set_xticklabels(ax.get_xmajorticklabels(), fontsize=14)
-    ax.set_yticklabels(ax.get_yticks(), fontsize=14)
-    plt.subplots_adjust(left=0.2, bottom=0.2)
-    plt.savefig(os.path.join(norm_dist_out, f"lammps-{function}-size-{size}.png"))
-    plt.clf()
-    plt.close()
+    ax.tick_params(labelsize=14)
+    fig.subplots_adjust(left=0.2, bottom=0.2)
 
 
-def plot_results(df, lammps, outdir):
+def draw_ebpf(fig, ax, data, function):
+    sns.lineplot(
+        data=data,
+        x="ranks",
+        y="time_nsecs",
+        markers=True,
+        dashes=True,
+        errorbar=("ci", 95),
+        hue="experiment",
+        palette="Set2",
+        ax=ax,
+    )
+    ax.set_title(f"eBPF function time for {function}")
+    ax.set_xlabel("size (ranks)", fontsize=16)
+    ax.set_ylabel("Time (log of nanoseconds)", fontsize=16)
+    ax.tick_params(labelsize=14)
+    ax.set_yscale("log")
+    fig.subplots_adjust(left=0.2, bottom=0.2)
+
+
+def draw_waterfall(fig, ax, data, size):
+    steps = numpy.arange(data.shape[0])
+    colors = numpy.where(data.seconds >= 0, "tab:red", "tab:green")
+    colors[(data.kind == "total").to_numpy()] = "tab:gray"
+    ax.bar(steps, data.end - data.start, bottom=data.start, color=colors)
+    ax.axhline(0, color="black", linewidth=0.8)
+    ax.set_xticks(steps, data.label, rotation=90, fontsize=8)
+    ax.set_title(f"Where the container overhead goes for size {size}")
+    ax.set_ylabel("Time per rank (seconds)", fontsize=16)
+    fig.subplots_adjust(left=0.2, bottom=0.45)
+
+
+# Kinds of plots the workers know how to draw
+renderers = {
+    "lammps": draw_lammps,
+    "distribution": draw_distribution,
+    "ebpf": draw_ebpf,
+    "waterfall": draw_waterfall,
+}
+
+
+def plot_lammps(lammps, outdir):
     """
-    Plot results
+    Plot lammps times
     """
-    # plot_lammps(lammps, outdir)
+    job = {
+        "kind": "lammps",
+        "args": {},
+        "data": lammps[["ranks", "time_seconds", "experiment"]],
+        "path": os.path.join(outdir, "lammps-times.png"),
+    }
+    render_plots([job], outdir, workers=1)
 
-    # For each metric, see if there is significant difference between means
-    # we would want to correct for multiple samples too.
 
-    # Keep record of results for each
-    diffs = pandas.DataFrame(columns=["function", "size", "pvalue", "statistic"])
-    idx = 0
-    not_used_singularity = {}
-    not_used_bare_metal = {}
+def plot_waterfall(waterfall, outdir, workers=None):
+    """
+    Plot where the wall time gap goes for each size
+    """
+    jobs = []
+    for size, data in waterfall.groupby("size"):
+        jobs.append(
+            {
+                "kind": "waterfall",
+                "args": {"size": int(size)},
+                "data": data[["label", "kind", "seconds", "start", "end"]],
+                "path": os.path.join(outdir, f"overhead-waterfall-size-{size}.png"),
+            }
+        )
+    render_plots(jobs, outdir, workers)
+
 
-    # Check for normal distribution
+def plot_distribution(df, outdir, workers=None):
+    """
+    Plot the distribution of times for each function and size (to check normal)
+    """
     norm_dist_out = os.path.join(outdir, "check-normal")
     if not os.path.exists(norm_dist_out):
         os.makedirs(norm_dist_out)
 
-    for function in df.function.unique():
-        subset = df[df.function == function]
-        for size in df.ranks.unique():
-            sized = subset[subset.ranks == size]
-            if sized.shape[0] == 0:
-                continue
-
-            # Do a t test! Two tailed means we can get a change in either direction
-            singularity = sized[sized.experiment == "singularity"].time_nsecs.tolist()
-            bare_metal = sized[sized.experiment == "bare-metal"].time_nsecs.tolist()
-
-            # We would want to sanity check these and understand why!
-            if len(singularity) == 0:
-                if size not in not_used_singularity:
-                    not_used_singularity[str(size)] = []
-                not_used_singularity[str(size)].append(function)
-                print(
-                    f"Warning function {function} is not used for singularity size {size}."
-                )
-            if len(bare_metal) == 0:
-                if size not in not_used_bare_metal:
-                    not_used_bare_metal[str(size)] = []
-                not_used_bare_metal[str(size)].append(function)
-                print(
-                    f"Warning function {function} is not used for bare metal size {size}."
-                )
-            if len(singularity) == 0 or len(bare_metal) == 0:
-                continue
-
-            # For now require >1 for both (we need more samples here)
-            if len(singularity) <= 1 or len(bare_metal) <= 1:
-                continue
-
-            # plot_distribution(singularity, bare_metal, norm_dist_out)
-
-            res = stats.ttest_ind(singularity, bare_metal)
-            diffs.loc[idx, :] = [function, size, res.pvalue, res.statistic]
-            idx += 1
-
-    diffs = diffs.sort_values("pvalue")
-
-    # Bonferonni correction
-    rejected, p_adjusted, _, alpha_corrected = multipletests(
-        diffs["pvalue"].tolist(), method="bonferroni"
+    jobs = []
+    subset = df[df.experiment.isin(["singularity", "bare-metal"])]
+    for (function, size), data in subset.groupby(["function", "ranks"], observed=True):
+        jobs.append(
+            {
+                "kind": "distribution",
+                "args": {"function": function, "size": int(size)},
+                "data": data[["experiment", "time_nsecs"]],
+                "path": os.path.join(
+                    norm_dist_out, f"lammps-{function}-size-{size}.png"
+                ),
+            }
+        )
+    render_plots(jobs, outdir, workers)
+
+
+def adjust_pvalues(pvalues, method="bonferroni", alpha=0.05):
+    """
+    Correct p-values for multiple tests, all at once.
+
+    This gives the same adjusted p-values as statsmodels multipletests.
+    P-values that are not finite (e.g., no variance) are not counted as tests.
+    """
+    pvalues = numpy.asarray(pvalues, dtype=float)
+    adjusted = numpy.full(pvalues.shape, numpy.nan)
+    tested = numpy.isfinite(pvalues)
+    p = pvalues[tested]
+    m = p.shape[0]
+    if method == "bonferroni":
+        corrected = p * m
+    else:
+        order = numpy.argsort(p, kind="stable")
+        ranked = p[order]
+        if method == "holm":
+            ranked = numpy.maximum.accumulate(ranked * (m - numpy.arange(m)))
+        elif method == "fdr_bh":
+            ranked = ranked * m / numpy.arange(1, m + 1)
+            ranked = numpy.minimum.accumulate(ranked[::-1])[::-1]
+        else:
+            raise ValueError(f"Unknown correction {method}")
+        corrected = numpy.empty(m)
+        corrected[order] = ranked
+    adjusted[tested] = numpy.minimum(corrected, 1)
+    return adjusted, tested & (adjusted <= alpha)
+
+
+def group_stats(df, experiments, keys=("function", "ranks"), value="time_nsecs"):
+    """
+    Get n, mean and variance for each group and experiment in one groupby.
+
+    The result has a row per group, and a column per (stat, experiment).
+    Experiments without data for a group have a count of 0.
+    """
+    columns = pandas.MultiIndex.from_product([["count", "mean", "var"], experiments])
+    groups = (
+        df[df.experiment.isin(experiments)]
+        .groupby(list(keys) + ["experiment"], observed=True)[value]
+        .agg(["count", "mean", "var"])
+        .unstack("experiment")
+        .reindex(columns=columns)
+    )
+    groups["count"] = groups["count"].fillna(0)
+    return groups
+
+
+def two_sample_tests(
+    df,
+    a="singularity",
+    b="bare-metal",
+    test="student",
+    correction="bonferroni",
+    alpha=0.05,
+):
+    """
+    Two sample t-tests (a vs. b) for every function and size at once.
+
+    Student (equal variance) and Welch t and p-values are array operations
+    over all groups, and the correction is done in the same pass. We need
+    more than one sample for each experiment to test.
+    """
+    groups = group_stats(df, [a, b])
+    n1, n2 = groups[("count", a)].to_numpy(), groups[("count", b)].to_numpy()
+    m1, m2 = groups[("mean", a)].to_numpy(), groups[("mean", b)].to_numpy()
+    v1, v2 = groups[("var", a)].to_numpy(), groups[("var", b)].to_numpy()
+
+    # Functions that are not used for an experiment and size
+    not_used = {}
+    for experiment, n in [(a, n1), (b, n2)]:
+        not_used[experiment] = {}
+        for function, size in groups.index[n == 0]:
+            not_used[experiment].setdefault(str(size), []).append(function)
+
+    tested = (n1 > 1) & (n2 > 1)
+    groups = groups[tested]
+    n1, n2, m1, m2, v1, v2 = [x[tested] for x in [n1, n2, m1, m2, v1, v2]]
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        diff = m1 - m2
+        dof = n1 + n2 - 2
+        pooled = ((n1 - 1) * v1 + (n2 - 1) * v2) / dof
+        student = diff / numpy.sqrt(pooled * (1 / n1 + 1 / n2))
+        student_p = 2 * special.stdtr(dof, -numpy.abs(student))
+
+        s1, s2 = v1 / n1, v2 / n2
+        welch = diff / numpy.sqrt(s1 + s2)
+        welch_dof = (s1 + s2) ** 2 / (s1**2 / (n1 - 1) + s2**2 / (n2 - 1))
+        welch_p = 2 * special.stdtr(welch_dof, -numpy.abs(welch))
+
+    statistic, pvalue = (student, student_p) if test == "student" else (welch, welch_p)
+    adjusted, rejected = adjust_pvalues(pvalue, correction, alpha)
+    diffs = pandas.DataFrame(
+        {
+            "function": groups.index.get_level_values("function"),
+            "size": groups.index.get_level_values("ranks"),
+            "pvalue": adjusted,
+            "statistic": statistic,
+            "rejected": rejected,
+            "pvalue_raw": pvalue,
+            "student_statistic": student,
+            "student_pvalue": student_p,
+            "welch_statistic": welch,
+            "welch_pvalue": welch_p,
+            f"n_{a}": n1.astype(int),
+            f"n_{b}": n2.astype(int),
+            f"mean_{a}": m1,
+            f"mean_{b}": m2,
+            f"std_{a}": numpy.sqrt(v1),
+            f"std_{b}": numpy.sqrt(v2),
+        }
+    )
+    diffs = diffs.sort_values("pvalue_raw", kind="stable").reset_index(drop=True)
+    return diffs, not_used
+
+
+def get_samples(df, groups, experiment, keys=("function", "ranks"), value="time_nsecs"):
+    """
+    Get a matrix of samples (one row per group) for an experiment.
+
+    The samples of each group come first in its row, padded with nan.
+    """
+    subset = df[df.experiment == experiment]
+    position = subset.groupby(list(keys), observed=True).cumcount()
+    samples = subset.set_index(list(keys) + [position])[value].unstack()
+    return samples.reindex(groups).to_numpy(dtype=float)
+
+
+def permutation_pvalues(a, b, permutations, rng, max_bytes):
+    """
+    Two sided label permutation test for the difference in means, for each row.
+
+    All rows share one matrix of permuted labels (1 for a), so the sums for
+    every permutation are one matrix product. We go through the rows in
+    chunks so memory stays under max_bytes.
+    """
+    n1, n2 = a.shape[1], b.shape[1]
+    x = numpy.concatenate([a, b], axis=1)
+    total = x.sum(axis=1)
+    observed = numpy.abs(a.mean(axis=1) - b.mean(axis=1))
+    observed = observed - 1e-9 * observed
+
+    # Each row has n1 ones at the first n1 positions of a permutation
+    index = numpy.argsort(rng.random((permutations, n1 + n2)), axis=1)[:, :n1]
+    labels = numpy.zeros((permutations, n1 + n2))
+    numpy.put_along_axis(labels, index, 1, axis=1)
+
+    extreme = numpy.zeros(x.shape[0])
+    chunk = max(1, max_bytes // (permutations * 8 * 2))
+    for start in range(0, x.shape[0], chunk):
+        end = start + chunk
+        first = x[start:end] @ labels.T
+        diff = first / n1 - (total[start:end, None] - first) / n2
+        extreme[start:end] = (numpy.abs(diff) >= observed[start:end, None]).sum(axis=1)
+    return (extreme + 1) / (permutations + 1)
+
+
+def bootstrap_intervals(a, b, resamples, rng, max_bytes, confidence=0.95):
+    """
+    Percentile bootstrap intervals for the difference in means, for each row.
+
+    A resample is how many times each sample is drawn (multinomial counts),
+    so the resampled means for every row are one matrix product too.
+    """
+    n1, n2 = a.shape[1], b.shape[1]
+    counts_a = rng.multinomial(n1, numpy.full(n1, 1 / n1), size=resamples) / n1
+    counts_b = rng.multinomial(n2, numpy.full(n2, 1 / n2), size=resamples) / n2
+    tail = (1 - confidence) / 2 * 100
+    low = numpy.empty(a.shape[0])
+    high = numpy.empty(a.shape[0])
+    chunk = max(1, max_bytes // (resamples * 8 * 2))
+    for start in range(0, a.shape[0], chunk):
+        end = start + chunk
+        diff = a[start:end] @ counts_a.T - b[start:end] @ counts_b.T
+        low[start:end], high[start:end] = numpy.percentile(
+            diff, [tail, 100 - tail], axis=1
+        )
+    return low, high
+
+
+def nonparametric_tests(
+    df,
+    a="singularity",
+    b="bare-metal",
+    permutations=10000,
+    resamples=10000,
+    correction="bonferroni",
+    alpha=0.05,
+    seed=0,
+    max_bytes=256 * 1024 * 1024,
+):
+    """
+    Mann-Whitney and permutation tests, and bootstrap intervals (a - b) for
+    every function and size at once.
+
+    Function times are rarely normal, so these don't assume it. Groups with
+    the same sample sizes are done together and share the permutation and
+    bootstrap indices, so the resampling is a few array operations.
+    """
+    groups = group_stats(df, [a, b])
+    n1 = groups[("count", a)].to_numpy().astype(int)
+    n2 = groups[("count", b)].to_numpy().astype(int)
+    tested = (n1 > 1) & (n2 > 1)
+    groups, n1, n2 = groups[tested], n1[tested], n2[tested]
+    samples_a = get_samples(df, groups.index, a)
+    samples_b = get_samples(df, groups.index, b)
+
+    rng = numpy.random.default_rng(seed)
+    results = {
+        name: numpy.full(groups.shape[0], numpy.nan)
+        for name in ["mw_statistic", "mw_pvalue", "perm_pvalue", "ci_low", "ci_high"]
+    }
+    for size1, size2 in set(zip(n1, n2)):
+        rows = numpy.where((n1 == size1) & (n2 == size2))[0]
+        x, y = samples_a[rows, :size1], samples_b[rows, :size2]
+        # Auto is exact for small samples (the normal approximation is poor)
+        mw = stats.mannwhitneyu(x, y, axis=1, method="auto")
+        results["mw_statistic"][rows] = mw.statistic
+        results["mw_pvalue"][rows] = mw.pvalue
+        results["perm_pvalue"][rows] = permutation_pvalues(
+            x, y, permutations, rng, max_bytes
+        )
+        low, high = bootstrap_intervals(x, y, resamples, rng, max_bytes)
+        results["ci_low"][rows] = low
+        results["ci_high"][rows] = high
+
+    mw_adjusted, mw_rejected = adjust_pvalues(results["mw_pvalue"], correction, alpha)
+    perm_adjusted, perm_rejected = adjust_pvalues(
+        results["perm_pvalue"], correction, alpha
+    )
+    tests = pandas.DataFrame(
+        {
+            "function": groups.index.get_level_values("function"),
+            "size": groups.index.get_level_values("ranks"),
+            f"n_{a}": n1,
+            f"n_{b}": n2,
+            "mean_diff": groups[("mean", a)].to_numpy()
+            - groups[("mean", b)].to_numpy(),
+            "ci_low": results["ci_low"],
+            "ci_high": results["ci_high"],
+            "mw_statistic": results["mw_statistic"],
+            "mw_pvalue_raw": results["mw_pvalue"],
+            "mw_pvalue": mw_adjusted,
+            "mw_rejected": mw_rejected,
+            "perm_pvalue_raw": results["perm_pvalue"],
+            "perm_pvalue": perm_adjusted,
+            "perm_rejected": perm_rejected,
+        }
     )
-    diffs["pvalue"] = p_adjusted
-    diffs["rejected"] = rejected
+    return tests.sort_values("mw_pvalue_raw", kind="stable").reset_index(drop=True)
+
+
+def attribution_intervals(x, y, wall_x, wall_y, resamples, rng, max_bytes, confidence):
+    """
+    Percentile bootstrap intervals for function contributions, for each row.
+
+    Runs are resampled together (the same counts for function and wall
+    times), so intervals for the share of the gap include its noise too.
+    """
+    n1, n2 = x.shape[1], y.shape[1]
+    counts_a = rng.multinomial(n1, numpy.full(n1, 1 / n1), size=resamples) / n1
+    counts_b = rng.multinomial(n2, numpy.full(n2, 1 / n2), size=resamples) / n2
+    walls = counts_b @ wall_y
+    gaps = counts_a @ wall_x - walls
+    tail = (1 - confidence) / 2 * 100
+    intervals = {
+        name: numpy.empty((x.shape[0], 2))
+        for name in ["delta", "percent_of_wall", "share_of_gap"]
+    }
+    chunk = max(1, max_bytes // (resamples * 8 * 4))
+    for start in range(0, x.shape[0], chunk):
+        end = start + chunk
+        diff = x[start:end] @ counts_a.T - y[start:end] @ counts_b.T
+
+        # A resample can have no gap, so the share is not finite
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            values = {
+                "delta": diff,
+                "percent_of_wall": diff / walls * 100,
+                "share_of_gap": diff / gaps * 100,
+            }
+            for name, value in values.items():
+                intervals[name][start:end] = numpy.percentile(
+                    value, [tail, 100 - tail], axis=1
+                ).T
+    return intervals
+
+
+def attribute_overhead(
+    df,
+    a="singularity",
+    b="bare-metal",
+    resamples=10000,
+    confidence=0.95,
+    seed=0,
+    max_bytes=256 * 1024 * 1024,
+):
+    """
+    Attribute the wall time gap (a - b) to functions, for every function and
+    size at once.
+
+    Function times are summed over ranks, so divided by ranks they are the
+    time each rank spent in the function, the same scale as wall time. A
+    contribution is that time in a minus b, as seconds, as a percent of the
+    wall time of b, and as a percent of the wall time gap. A run without
+    a function spent no time in it. Each size is one matrix (functions by
+    runs), and the bootstrap is a matrix product over all of its functions.
+    """
+    subset = df[df.experiment.isin([a, b])]
+    seconds = subset.time_nsecs.to_numpy() / subset.ranks.to_numpy() / 1e9
+    subset = subset.assign(seconds=seconds)
+    rng = numpy.random.default_rng(seed)
+
+    frames = []
+    for size, data in subset.groupby("ranks", observed=True):
+        runs = ["experiment", "iteration"]
+        times = (
+            data.groupby(["function"] + runs, observed=True)["seconds"]
+            .sum()
+            .unstack(runs, fill_value=0)
+        )
+        wall = data.groupby(runs, observed=True)["time_seconds"].first()
+        wall = wall.reindex(times.columns)
+        if a not in times.columns or b not in times.columns:
+            continue
+        x, y = times[a].to_numpy(), times[b].to_numpy()
+        wall_x, wall_y = wall[a].to_numpy(), wall[b].to_numpy()
+        if x.shape[1] < 2 or y.shape[1] < 2:
+            continue
+
+        delta = x.mean(axis=1) - y.mean(axis=1)
+        gap = wall_x.mean() - wall_y.mean()
+        intervals = attribution_intervals(
+            x, y, wall_x, wall_y, resamples, rng, max_bytes, confidence
+        )
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            frame = pandas.DataFrame(
+                {
+                    "size": size,
+                    "function": times.index.to_numpy(),
+                    f"n_{a}": x.shape[1],
+                    f"n_{b}": y.shape[1],
+                    f"seconds_per_rank_{a}": x.mean(axis=1),
+                    f"seconds_per_rank_{b}": y.mean(axis=1),
+                    "delta_seconds": delta,
+                    "delta_low": intervals["delta"][:, 0],
+                    "delta_high": intervals["delta"][:, 1],
+                    "percent_of_wall": delta / wall_y.mean() * 100,
+                    "percent_of_wall_low": intervals["percent_of_wall"][:, 0],
+                    "percent_of_wall_high": intervals["percent_of_wall"][:, 1],
+                    "share_of_gap": delta / gap * 100,
+                    "share_of_gap_low": intervals["share_of_gap"][:, 0],
+                    "share_of_gap_high": intervals["share_of_gap"][:, 1],
+                    f"wall_{a}": wall_x.mean(),
+                    f"wall_{b}": wall_y.mean(),
+                    "wall_gap": gap,
+                }
+            )
+        frames.append(frame.sort_values("delta_seconds", ascending=False))
+
+    if not frames:
+        return pandas.DataFrame()
+    attribution = pandas.concat(frames, ignore_index=True)
+    attribution.insert(1, "rank", attribution.groupby("size").cumcount().to_numpy() + 1)
+    return attribution
+
+
+def overhead_waterfall(attribution, top=15):
+    """
+    Make a waterfall (ranked steps) of the wall time gap for each size.
+
+    The top functions (by absolute contribution) come first, then the rest
+    of the functions, then what the functions we traced don't explain.
+    """
+    rows = []
+    if attribution.empty:
+        return pandas.DataFrame(rows)
+    for size, data in attribution.groupby("size"):
+        gap = data.wall_gap.iloc[0]
+        order = numpy.argsort(-numpy.abs(data.delta_seconds.to_numpy()), kind="stable")
+        chosen = data.iloc[numpy.sort(order[:top])]
+        steps = list(zip(chosen.function, chosen.delta_seconds))
+        rest = data.delta_seconds.sum() - chosen.delta_seconds.sum()
+        steps.append((f"{len(data) - len(chosen)} other functions", rest))
+        steps.append(("not in traced functions", gap - data.delta_seconds.sum()))
+
+        position = 0
+        for label, seconds in steps:
+            rows.append(
+                {
+                    "size": size,
+                    "label": label,
+                    "kind": "step",
+                    "seconds": seconds,
+                    "start": position,
+                    "end": position + seconds,
+                }
+            )
+            position += seconds
+        rows.append(
+            {
+                "size": size,
+                "label": "wall time gap",
+                "kind": "total",
+                "seconds": gap,
+                "start": 0,
+                "end": gap,
+            }
+        )
+    return pandas.DataFrame(rows)
+
+
+def plot_results(
+    df,
+    runs,
+    outdir,
+    test="student",
+    correction="bonferroni",
+    permutations=10000,
+    resamples=10000,
+    seed=0,
+):
+    """
+    Plot results
+    """
+    # For each metric, see if there is significant difference between means
+    # we would want to correct for multiple samples too.
+
+    # Two tailed means we can get a change in either direction
+    diffs, not_used = two_sample_tests(df, test=test, correction=correction)
+    for experiment, sizes in not_used.items():
+        for size, functions in sizes.items():
+            print(
+                f"Warning {len(functions)} functions are not used for {experiment} size {size}."
+            )
     sigs = diffs[diffs.rejected == True]
 
-    # TODO add means / std for each
     diffs.to_csv(os.path.join(outdir, "two-sample-t.csv"))
     sigs.to_csv(os.path.join(outdir, "two-sample-t-reject-null.csv"))
     utils.write_json(
-        not_used_singularity,
+        not_used["singularity"],
         os.path.join(outdir, "functions-not-used-singularity.json"),
     )
     utils.write_json(
-        not_used_bare_metal,
+        not_used["bare-metal"],
         os.path.join(outdir, "functions-not-used-bare-metal.json"),
     )
 
+    # Function times are rarely normal, so check with tests that don't assume it
+    if permutations > 0:
+        tests = nonparametric_tests(
+            df,
+            permutations=permutations,
+            resamples=resamples,
+            correction=correction,
+            seed=seed,
+        )
+        tests.to_csv(os.path.join(outdir, "nonparametric-tests.csv"))
+
     import IPython
 
     IPython.embed()
 
 
-def plot_ebpf(df, outdir):
-    for func in df.function.unique():
-        subset = df[df.function == func]
-        print(subset)
-        ax = sns.lineplot(
-            data=subset,
-            x="ranks",
-            y="time_nsecs",
-            markers=True,
-            dashes=True,
-            errorbar=("ci", 95),
-            hue="experiment",
-            palette="Set2",
+def plot_ebpf(df, outdir, workers=None):
+    """
+    Plot time for each ebpf function across sizes.
+    """
+    jobs = []
+    for function, data in df.groupby("function", observed=True):
+        jobs.append(
+            {
+                "kind": "ebpf",
+                "args": {"function": function},
+                "data": data[["ranks", "time_nsecs", "experiment"]],
+                "path": os.path.join(outdir, f"ebpf-{function}.png"),
+            }
         )
-        plt.title(f"eBPF function time for {func}")
-        ax.set_xlabel("size (ranks)", fontsize=16)
-        ax.set_ylabel("Time (log of nanoseconds)", fontsize=16)
-        ax.set_xticklabels(ax.get_xmajorticklabels(), fontsize=14)
-        ax.set_yticklabels(ax.get_yticks(), fontsize=14)
-        plt.subplots_adjust(left=0.2, bottom=0.2)
-        plt.yscale("log")
-        plt.savefig(os.path.join(outdir, f"ebpf-{func}.png"))
-        plt.clf()
-        plt.close()
-
-
-def parse_data(files):
-    """
-    Given a listing of files, parse into results data frame
-    """
-    # Parse into data frame
-    df = pandas.DataFrame(
-        columns=[
-            "ranks",
-            "experiment",
-            "iteration",
-            "time_seconds",
-            "nodes",
-            "percent_cpu_utilization",
-            "function",
-            "count",
-            "time_nsecs",
-        ]
-    )
-    idx = 0
-
-    # And only to compare lammps times
-    lammps = pandas.DataFrame(
-        columns=[
-            "ranks",
-            "experiment",
-            "iteration",
-            "time_seconds",
-            "nodes",
-            "percent_cpu_utilization",
-        ]
-    )
-    idxl = 0
+    render_plots(jobs, outdir, workers)
 
-    total = len(files)
-    for i, filename in enumerate(files):
-        print(f"Parsing {i} of {total}", end="\r")
-        parsed = os.path.relpath(filename, here)
-        pieces = parsed.split(os.sep)
-        experiment = pieces[-2]
-        filebase = pieces[-1]
-        _, iteration, _ = filebase.replace(".out", "").split("-")
 
-        # Save CPU line
-        # This is a list, each a json result, 20x
-        item = utils.read_file(filename)
+def make_block(columns, n, **values):
+    """
+    Make a block of typed columns for one file.
+
+    Values can be a single value (repeated n times) or an array of n.
+    Categories are encoded here, so a worker never sends strings per row.
+    """
+    block = {}
+    for name, dtype in columns.items():
+        value = values[name]
+        if dtype == "category" and numpy.ndim(value) == 0:
+            block[name] = pandas.Categorical.from_codes(numpy.zeros(n, "int8"), [value])
+        elif dtype == "category":
+            block[name] = pandas.Categorical(value)
+        elif numpy.ndim(value) == 0:
+            block[name] = numpy.full(n, value, dtype=dtype)
+        else:
+            block[name] = numpy.asarray(value, dtype=dtype)
+    return block
+
+
+def concat_blocks(columns, blocks):
+    """
+    Concatenate column blocks into one data frame (one allocation per column)
+    """
+    data = {}
+    for name, dtype in columns.items():
+        arrays = [block[name] for block in blocks]
+        if not arrays:
+            data[name] = pandas.Series([], dtype=dtype)
+        elif dtype == "category":
+            data[name] = union_categoricals(arrays)
+        else:
+            data[name] = numpy.concatenate(arrays)
+    return pandas.DataFrame(data)
+
+
+def concat_frames(frames):
+    """
+    Concatenate frames, and keep categories (pandas.concat would not)
+    """
+    data = {}
+    for name in frames[0].columns:
+        columns = [frame[name] for frame in frames]
+        if isinstance(columns[0].dtype, pandas.CategoricalDtype):
+            data[name] = union_categoricals(columns)
+        else:
+            data[name] = numpy.concatenate([column.to_numpy() for column in columns])
+    return pandas.DataFrame(data)
+
+
+def register_parser(app, **patterns):
+    """
+    Register a parser for the output of an application.
+
+    Each pattern is (markers, regex) for a line we want. The regex has named
+    groups for its values and {number} for a number, and leading space is
+    skipped. Markers are literal bytes on the line, so we find lines with
+    byte searches and only match the regex on them. Lines without a marker
+    (e.g., rows of numbers) are matched over the application output. The
+    decorated function gets the matches (a list of dicts per pattern) and
+    returns the wall time, ranks and figures of merit.
+    """
+    lines = {}
+    for name, (markers, pattern) in patterns.items():
+        pattern = pattern.replace(b"{number}", number)
+        if isinstance(markers, bytes):
+            markers = (markers,)
+        flags = "" if markers else "(?m)^"
+        lines[name] = {
+            "markers": markers,
+            "regex": re.compile(flags.encode("utf-8") + rb"[ \t]*(?:" + pattern + b")"),
+        }
+
+    def register(func):
+        parsers[app] = {"lines": lines, "parse": func}
+        return func
+
+    return register
+
+
+def get_value(found, name, group, cast=float, last=True):
+    """
+    Get a value from the last (or first) match of a pattern, if we have it.
+    """
+    matches = found.get(name)
+    if not matches:
+        return None
+    return cast(matches[-1 if last else 0][group])
+
+
+def require(found, app, *names):
+    """
+    Make sure we have lines we can't do without.
+    """
+    for name in names:
+        if name not in found:
+            raise ValueError(f"Cannot find {name} line in {app} output")
+
+
+@register_parser(
+    "lammps",
+    cpu=(b"% CPU use", rb"(?P<cpu>{number})% CPU use"),
+    loop=(
+        b"Loop time of",
+        rb"Loop time of (?P<loop_time>{number}) on (?P<procs>\d+) procs",
+    ),
+    performance=(b"Performance:", rb"Performance: (?P<performance>[^\n]+)"),
+    wall=(
+        b"Total wall time:",
+        rb"Total wall time: (?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+)",
+    ),
+)
+def parse_lammps(found):
+    require(found, "lammps", "cpu", "loop", "wall")
+    wall = found["wall"][-1]
+    foms = {"loop_time_seconds": get_value(found, "loop", "loop_time")}
+
+    # e.g., 0.865 ns/day, 27.743 hours/ns, 10.012 timesteps/s
+    for performance in found.get("performance", [])[-1:]:
+        for item in performance["performance"].split(","):
+            value, unit = item.split(None, 1)
+            foms[unit.strip()] = float(value)
+    return {
+        "time_seconds": int(wall["hours"]) * 3600
+        + int(wall["minutes"]) * 60
+        + int(wall["seconds"]),
+        "ranks": get_value(found, "loop", "procs", int),
+        "percent_cpu_utilization": get_value(found, "cpu", "cpu", last=False),
+        "foms": foms,
+    }
+
+
+@register_parser(
+    "amg2023",
+    procs=(
+        b"(Px, Py, Pz)",
+        rb"\(Px, Py, Pz\)\s*=\s*\((?P<px>\d+),\s*(?P<py>\d+),\s*(?P<pz>\d+)\)",
+    ),
+    wall=(b"wall clock time", rb"wall clock time\s*=\s*(?P<wall>{number}) seconds"),
+    fom=(
+        b"FOM",
+        rb"(?P<fom_name>FOM_\w+|Figure of Merit \(FOM\)):[^\n]*?(?P<fom>{number})[ \t]*$",
+    ),
+)
+def parse_amg2023(found):
+    ranks = None
+    if "procs" in found:
+        procs = found["procs"][-1]
+        ranks = int(procs["px"]) * int(procs["py"]) * int(procs["pz"])
+
+    # Setup and solve phases are timed separately
+    foms = {m["fom_name"]: float(m["fom"]) for m in found.get("fom", [])}
+    walls = [float(m["wall"]) for m in found.get("wall", [])]
+    return {"time_seconds": sum(walls) if walls else None, "ranks": ranks, "foms": foms}
+
+
+@register_parser(
+    "kripke",
+    procs=(b"Total MPI tasks:", rb"Total MPI tasks:\s*(?P<procs>\d+)"),
+    grid=(
+        b"Processor grid:",
+        rb"Processor grid:\s*(?P<gx>\d+) x (?P<gy>\d+) x (?P<gz>\d+)",
+    ),
+    timer=(
+        b"Solve",
+        rb"(?P<timer>Solve|SweepSolver)\s+(?P<calls>\d+)\s+(?P<seconds>{number})",
+    ),
+    fom=(
+        (b"Throughput", b"Grind time", b"Sweep efficiency"),
+        rb"(?P<fom_name>Throughput|Grind time|Sweep efficiency)\s*:\s*(?P<fom>{number})",
+    ),
+)
+def parse_kripke(found):
+    ranks = get_value(found, "procs", "procs", int)
+    if ranks is None and "grid" in found:
+        grid = found["grid"][-1]
+        ranks = int(grid["gx"]) * int(grid["gy"]) * int(grid["gz"])
+    timers = {m["timer"]: float(m["seconds"]) for m in found.get("timer", [])}
+    foms = {m["fom_name"]: float(m["fom"]) for m in found.get("fom", [])}
+    foms.update({f"{k} seconds": v for k, v in timers.items()})
+    return {"time_seconds": timers.get("Solve"), "ranks": ranks, "foms": foms}
+
+
+@register_parser(
+    "laghos",
+    wall=(
+        b"Major kernels total time",
+        rb"Major kernels total time \(seconds\):\s*(?P<wall>{number})",
+    ),
+    rate=(b"rate (", rb"(?P<rate_name>[^\n:]*?rate) \([^\n:]*\):\s*(?P<rate>{number})"),
+)
+def parse_laghos(found):
+    foms = {m["rate_name"]: float(m["rate"]) for m in found.get("rate", [])}
+    return {"time_seconds": get_value(found, "wall", "wall"), "foms": foms}
+
+
+@register_parser(
+    "minife",
+    procs=(b"number of processors:", rb"number of processors:\s*(?P<procs>\d+)"),
+    wall=(b"Total Program Time:", rb"Total Program Time:\s*(?P<wall>{number})"),
+    mflops=(b"Total CG Mflops:", rb"Total CG Mflops:\s*(?P<mflops>{number})"),
+)
+def parse_minife(found):
+    return {
+        "time_seconds": get_value(found, "wall", "wall"),
+        "ranks": get_value(found, "procs", "procs", int),
+        "foms": {"Total CG Mflops": get_value(found, "mflops", "mflops")},
+    }
+
+
+@register_parser(
+    "quicksilver",
+    main=(
+        b"main",
+        rb"main\s+(?P<calls>\d+)\s+(?P<min>{number})\s+(?P<avg>{number})\s+(?P<max>{number})",
+    ),
+    fom=(b"Figure Of Merit", rb"Figure Of Merit\s+(?P<fom>{number})"),
+)
+def parse_quicksilver(found):
+    # The timers are in microseconds, the slowest rank is the wall time
+    wall = get_value(found, "main", "max")
+    return {
+        "time_seconds": None if wall is None else wall / 1e6,
+        "foms": {"Figure Of Merit": get_value(found, "fom", "fom")},
+    }
 
-        # I think my session was killed
-        if not item:
-            continue
 
-        line = [x for x in item.split("\n") if "CPU use" in x]
-        percent_cpu_usage = float(line[0].split(" ")[0].replace("%", ""))
-
-        # Full command is the first item
-        result = parse_lammps(item)
-        seconds = result["total_wall_time_seconds"]
-        ranks = result["ranks"]
-
-        # Save all lammps times
-        lammps.loc[idxl, :] = [
-            int(ranks),
-            experiment,
-            int(iteration),
-            seconds,
-            1,
-            percent_cpu_usage,
-        ]
-        idxl += 1
-
-        # These just have lammps times
-        if "no-ebpf" in filename:
+@register_parser(
+    "pennant",
+    procs=(b"MPI PE", rb"Running on (?P<procs>\d+) MPI PE"),
+    cycle=(b"cycle", rb"cycle\s*=\s*(?P<cycle>\d+)"),
+    wall=(b"hydro cycle run time=", rb"hydro cycle run time=\s*(?P<wall>{number})"),
+)
+def parse_pennant(found):
+    wall = get_value(found, "wall", "wall")
+    cycles = get_value(found, "cycle", "cycle", int)
+    foms = {}
+    if wall and cycles:
+        foms["cycles/s"] = cycles / wall
+    return {
+        "time_seconds": wall,
+        "ranks": get_value(found, "procs", "procs", int),
+        "foms": foms,
+    }
+
+
+@register_parser(
+    "nek5000",
+    procs=(
+        (b"Number of processors", b"Number of MPI ranks", b"MPI tasks"),
+        rb"(?:Number of processors|Number of MPI ranks|MPI tasks)\s*:\s*(?P<procs>\d+)",
+    ),
+    wall=(
+        (b"total elapsed time", b"elapsedStepSum"),
+        rb"(?:total elapsed time|elapsedStepSum)\s*:?\s*(?P<wall>{number})",
+    ),
+)
+def parse_nek5000(found):
+    return {
+        "time_seconds": get_value(found, "wall", "wall"),
+        "ranks": get_value(found, "procs", "procs", int),
+        "foms": {},
+    }
+
+
+@register_parser(
+    "gromacs",
+    procs=(
+        (b"MPI processes", b"MPI threads"),
+        rb"Using (?P<procs>\d+) MPI (?:processes|threads)",
+    ),
+    wall=(b"Time:", rb"Time:\s+(?P<core>{number})\s+(?P<wall>{number})"),
+    performance=(
+        b"Performance:",
+        rb"Performance:\s+(?P<ns_day>{number})\s+(?P<hour_ns>{number})",
+    ),
+)
+def parse_gromacs(found):
+    return {
+        "time_seconds": get_value(found, "wall", "wall"),
+        "ranks": get_value(found, "procs", "procs", int),
+        "foms": {
+            "ns/day": get_value(found, "performance", "ns_day"),
+            "hour/ns": get_value(found, "performance", "hour_ns"),
+        },
+    }
+
+
+@register_parser(
+    "osu",
+    test=(b"# OSU MPI", rb"# OSU MPI(?:-\w+)? (?P<test>[^\n]+?) Test"),
+    row=(None, rb"(?P<size>\d+)\s+(?P<value>{number})"),
+)
+def parse_osu(found):
+    # A latency (us) or bandwidth (MB/s) per message size, for each test
+    foms = {}
+    test = get_value(found, "test", "test", str) or "osu"
+    for row in found.get("row", []):
+        foms[f"{test} {row['size']}"] = float(row["value"])
+    return {"foms": foms}
+
+
+@register_parser(
+    "stream",
+    rate=(
+        (b"Copy:", b"Scale:", b"Add:", b"Triad:"),
+        rb"(?P<function>Copy|Scale|Add|Triad):\s+(?P<rate>{number})",
+    ),
+)
+def parse_stream(found):
+    foms = {f"{m['function']} MB/s": float(m["rate"]) for m in found.get("rate", [])}
+    return {"foms": foms}
+
+
+@register_parser(
+    "mixbench",
+    row=(
+        None,
+        rb"(?P<iters>\d+),\s*(?P<sp_intensity>{number}),\s*(?P<sp_time>{number}),"
+        rb"\s*(?P<sp_gflops>{number}),\s*(?P<sp_bandwidth>{number}),"
+        rb"\s*(?P<dp_intensity>{number}),\s*(?P<dp_time>{number}),"
+        rb"\s*(?P<dp_gflops>{number}),\s*(?P<dp_bandwidth>{number})",
+    ),
+)
+def parse_mixbench(found):
+    # Peaks over the sweep of compute iterations (operational intensity)
+    foms = {}
+    rows = found.get("row", [])
+    for name in ["sp_gflops", "sp_bandwidth", "dp_gflops", "dp_bandwidth"]:
+        if rows:
+            foms[name] = max(float(row[name]) for row in rows)
+    return {"foms": foms}
+
+
+@register_parser(
+    "linpack",
+    result=(
+        None,
+        rb"W[RC]\S*\s+(?P<n>\d+)\s+(?P<nb>\d+)\s+(?P<p>\d+)\s+(?P<q>\d+)"
+        rb"\s+(?P<wall>{number})\s+(?P<gflops>{number})",
+    ),
+)
+def parse_linpack(found):
+    if "result" not in found:
+        return {"foms": {}}
+    result = found["result"][-1]
+    return {
+        "time_seconds": float(result["wall"]),
+        "ranks": int(result["p"]) * int(result["q"]),
+        "foms": {"Gflops": float(result["gflops"])},
+    }
+
+
+@register_parser(
+    "mt-gemm",
+    result=(
+        b"Performance=",
+        rb"Performance=\s*(?P<gflops>{number}) GFlop/s, Time=\s*(?P<msec>{number}) msec",
+    ),
+)
+def parse_mt_gemm(found):
+    msec = get_value(found, "result", "msec")
+    return {
+        "time_seconds": None if msec is None else msec / 1000,
+        "foms": {"GFlop/s": get_value(found, "result", "gflops")},
+    }
+
+
+def get_lines(mm, markers, end):
+    """
+    Find the start of each line (before end) that has one of the markers.
+    """
+    starts = set()
+    for marker in markers:
+        position = mm.find(marker, 0, end)
+        while position != -1:
+            starts.add(mm.rfind(b"\n", 0, position) + 1)
+            position = mm.find(marker, position + len(marker), end)
+    return sorted(starts)
+
+
+def get_blocks(mm, start, names=("RESULTS",)):
+    """
+    Get json blocks (e.g., === RESULTS START / END) from a mapped file.
+
+    We jump from one block to the next by offset, and only the blocks we
+    want are copied out of the map and decoded.
+    """
+    blocks = {}
+    position = start
+    while True:
+        position = mm.find(b"=== ", position)
+        if position == -1:
+            break
+        stop = mm.find(b"\n", position)
+        if stop == -1:
+            break
+        header = mm[position:stop].split()
+        if len(header) != 3 or header[2] != b"START":
+            position = stop
             continue
+        end = mm.find(b"=== %s END" % header[1], stop)
+        if end == -1:
+            break
+        name = header[1].decode("utf-8")
+        if name in names:
+            blocks[name] = json.loads(mm[stop + 1 : end])
+        position = end + len(header[1]) + 8
+    return blocks
+
+
+def scan_output(mm, parser, names=("RESULTS",)):
+    """
+    Find the lines a parser wants in a mapped results file, and its blocks.
+
+    Lines are only looked for in the application output (before the first
+    block), and json blocks are jumped over, never searched.
+    """
+    end = mm.find(b"\n=== ")
+    end = len(mm) if end == -1 else end
+    found = {}
+    for name, line in parser["lines"].items():
+        matches = []
+        if line["markers"]:
+            for start in get_lines(mm, line["markers"], end):
+                stop = mm.find(b"\n", start, end)
+                match = line["regex"].match(mm[start : end if stop == -1 else stop])
+                if match:
+                    matches.append(match)
+        else:
+            matches = line["regex"].finditer(mm, 0, end)
+        for match in matches:
+            values = {
+                key: value.decode("utf-8")
+                for key, value in match.groupdict().items()
+                if value is not None
+            }
+            found.setdefault(name, []).append(values)
+    return found, get_blocks(mm, end, names)
+
+
+def mean_per_rank(rows, fields):
+    """
+    Get the mean of fields per rank, for processes that have a rank.
+
+    A rank can be more than one process (e.g., a wrapper that execs).
+    """
+    rows = [row for row in rows if row.get("rank") is not None]
+    ranks = len({row["rank"] for row in rows})
+    if not ranks:
+        return {}
+    return {field: sum(row[field] for row in rows) / ranks for field in fields}
+
+
+def summarize_sched(block):
+    """
+    Off-CPU (blocked, preempted) and run queue time per rank (--sched)
+    """
+    return mean_per_rank(block, ["blocked_nsecs", "preempted_nsecs", "runq_nsecs"])
+
+
+def summarize_startup(block):
+    """
+    Startup time of the slowest rank (--startup), the run waits for it
+    """
+    times = [row["startup_nsecs"] for row in block if row.get("rank") is not None]
+    return {"startup_nsecs": max(times)} if times else {}
+
+
+def summarize_images(block):
+    """
+    Pages read from container images during the run (--image)
+    """
+    return {"image_pages": sum(image["pages"] for image in block)}
+
+
+def summarize_interference(block):
+    """
+    Migrations, IRQ and softirq time and timer ticks per rank (--interference)
+    """
+    fields = ["migrations", "irq_nsecs", "softirq_nsecs", "ticks"]
+    return mean_per_rank(block["ranks"], fields)
+
+
+# Blocks we summarize into run columns (see block_columns)
+run_blocks = {
+    "SCHED": summarize_sched,
+    "STARTUP": summarize_startup,
+    "IMAGES": summarize_images,
+    "INTERFERENCE": summarize_interference,
+}
+
+
+def get_app(pieces, default="lammps"):
+    """
+    Get the application for a results file, from its directories or prefix.
+    """
+    for piece in pieces:
+        if piece in parsers:
+            return piece
+    return default
+
+
+def get_file_app(filename, default="lammps"):
+    """
+    Get the application for a results file, or the default if it doesn't say.
+    """
+    pieces = os.path.relpath(filename, here).split(os.sep)
+    prefix = pieces[-1].replace(".out", "").rsplit("-", 2)[0]
+    return get_app(pieces[:-1] + [prefix], default)
+
+
+def parse_mapped(filename, mm, app="lammps"):
+    """
+    Parse a mapped results file into run, ebpf and figure of merit blocks.
+
+    The parser for the application finds the lines we need and the json
+    block with byte searches, so the file is never read into (or split as)
+    a string.
+    """
+    parsed = os.path.relpath(filename, here)
+    pieces = parsed.split(os.sep)
+    experiment = pieces[-2]
+    filebase = pieces[-1].replace(".out", "")
+    _, iteration, size = filebase.rsplit("-", 2)
+    app = get_file_app(filename, app)
+
+    found, blocks = scan_output(mm, parsers[app], ["RESULTS"] + list(run_blocks))
+    ebpf = blocks.get("RESULTS")
+    result = parsers[app]["parse"](found)
 
-        # Json result is here
-        ebpf = json.loads(
-            item.split("=== RESULTS START", 1)[-1].split("=== RESULTS END", 1)[0]
+    # Not every application tells us ranks, the filename has the size
+    ranks = result.get("ranks")
+    if ranks is None:
+        ranks = int(size) if size.isdigit() else 0
+    time_seconds = result.get("time_seconds")
+    percent_cpu_usage = result.get("percent_cpu_utilization")
+    values = {
+        "app": app,
+        "ranks": ranks,
+        "experiment": experiment,
+        "iteration": int(iteration),
+        "time_seconds": numpy.nan if time_seconds is None else time_seconds,
+        "nodes": 1,
+        "percent_cpu_utilization": (
+            numpy.nan if percent_cpu_usage is None else percent_cpu_usage
+        ),
+    }
+    values.update({name: numpy.nan for name in block_columns})
+    for name, summarize in run_blocks.items():
+        if name in blocks:
+            values.update(summarize(blocks[name]))
+
+    # Save all application times
+    run = make_block(run_columns, 1, **values)
+
+    # Figures of merit we did not find are left out
+    foms = {k: v for k, v in result.get("foms", {}).items() if v is not None}
+    fom = None
+    if foms:
+        fom = make_block(
+            fom_columns,
+            len(foms),
+            name=list(foms),
+            value=list(foms.values()),
+            **{k: values[k] for k in ["app", "ranks", "experiment", "iteration"]},
         )
 
-        for func in ebpf:
-            df.loc[idx, :] = [
-                int(ranks),
-                experiment,
-                iteration,
-                seconds,
-                1,
-                percent_cpu_usage,
-                func["func"],
-                func["count"],
-                func["time_nsecs"],
-            ]
-            idx += 1
-
-    df.ranks = df.ranks.astype(int)
-    df.nodes = df.nodes.astype(int)
-    df.time_nsecs = df.time_nsecs.astype(int)
-    df["count"] = df["count"].astype(int)
-    return df, lammps
+    # These just have application times
+    if "no-ebpf" in filename or ebpf is None:
+        return run, None, fom
+    block = make_block(
+        ebpf_columns,
+        len(ebpf),
+        function=[func["func"] for func in ebpf],
+        count=[func["count"] for func in ebpf],
+        time_nsecs=[func["time_nsecs"] for func in ebpf],
+        **values,
+    )
+    return run, block, fom
+
+
+def parse_file(filename, app="lammps", digest=None):
+    """
+    Parse one results file into run, ebpf and figure of merit blocks.
+
+    This runs in a worker, so it only returns arrays (and categories).
+    If a digest is given, it is updated from the same map.
+    """
+    with open(filename, "rb") as fd:
+        # I think my session was killed
+        if os.fstat(fd.fileno()).st_size == 0:
+            return None, None, None
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if digest is not None:
+                digest.update(mm)
+            return parse_mapped(filename, mm, app)
+
+
+def hash_file(filename, chunk=1 << 20):
+    """
+    Get the sha256 of a file, reading in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fd:
+        for data in iter(lambda: fd.read(chunk), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def parse_cached(filename, app="lammps"):
+    """
+    Parse one results file, and get what we need to cache it.
+
+    The entry has the app the file was parsed as, since a file that doesn't
+    name one is parsed as the default (--app).
+    """
+    st = os.stat(filename)
+    digest = hashlib.sha256()
+    blocks = dict(zip(frame_columns, parse_file(filename, app, digest)))
+    entry = {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+        "app": get_file_app(filename, app),
+    }
+    return blocks, entry
+
+
+def read_frame(cache, name):
+    path = os.path.join(cache, f"{name}.{cache_format}")
+    if not os.path.exists(path):
+        return None
+    if cache_format == "parquet":
+        return pandas.read_parquet(path)
+    return pandas.read_pickle(path)
+
+
+def write_frame(df, cache, name):
+    """
+    Write a frame to the cache, replacing the last one only when we are done.
+    """
+    path = os.path.join(cache, f"{name}.{cache_format}")
+    tmp = f"{path}.tmp"
+    if cache_format == "parquet":
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+def load_cache(cache):
+    """
+    Load the parse cache: an index of files, and the rows parsed from them.
+
+    The rows have a filename column so we can drop files that changed. The
+    cache has every app, we filter to one (--app) after loading.
+    """
+    index_file = os.path.join(cache, "index.json")
+    if not os.path.exists(index_file):
+        return {}, None
+    with open(index_file) as fd:
+        index = json.loads(fd.read())
+    if index.get("version") != cache_version or index.get("format") != cache_format:
+        return {}, None
+    frames = {name: read_frame(cache, name) for name in frame_columns}
+    if any(df is None for df in frames.values()):
+        return {}, None
+    return index["files"], frames
+
+
+def save_cache(cache, index, frames):
+    """
+    Save the parse cache, the index goes last so it never points to old rows.
+    """
+    os.makedirs(cache, exist_ok=True)
+    for name, df in frames.items():
+        write_frame(df, cache, name)
+    index = {
+        "version": cache_version,
+        "format": cache_format,
+        "files": index,
+    }
+    utils.write_json(index, os.path.join(cache, "index.json"))
+
+
+def is_cached(filename, entry, app="lammps"):
+    """
+    Determine if a file is unchanged since we cached it.
+
+    Size and mtime are enough most of the time, and if only the mtime changed
+    (e.g., a copy) we check the content hash before we parse it again. A file
+    that doesn't name an app is parsed again if the default (--app) changed.
+    """
+    if not entry or entry.get("app") != get_file_app(filename, app):
+        return False
+    st = os.stat(filename)
+    if st.st_size != entry["size"]:
+        return False
+    if st.st_mtime_ns != entry["mtime_ns"]:
+        if hash_file(filename) != entry["sha256"]:
+            return False
+        entry["mtime_ns"] = st.st_mtime_ns
+    return True
+
+
+def add_filename(block, filename):
+    """
+    Add the filename to a block, so we know what file rows come from.
+    """
+    block = dict(block)
+    n = len(next(iter(block.values())))
+    block["filename"] = pandas.Categorical.from_codes(
+        numpy.zeros(n, "int8"), [filename]
+    )
+    return block
+
+
+def parse_data(files, workers=None, cache=None, app="lammps"):
+    """
+    Given a listing of files, parse into results data frames
+
+    Files are parsed in a process pool, each into blocks of typed columns,
+    and the blocks are concatenated once at the end. With a cache, files
+    that did not change are loaded from it in bulk and not parsed again.
+    Files that don't say what application they are from are parsed as app.
+    """
+    index, cached_frames = {}, None
+    if cache:
+        index, cached_frames = load_cache(cache)
+
+    # Unchanged files come from the cache, the rest are parsed
+    keep = {}
+    todo = []
+    for filename in files:
+        entry = dict(index.get(filename) or {})
+        if is_cached(filename, entry, app):
+            keep[filename] = entry
+        else:
+            todo.append(filename)
+
+    cached = list(keep)
+    blocks = {name: [] for name in frame_columns}
+
+    total = len(todo)
+    workers = workers or os.cpu_count()
+    chunksize = max(1, total // (workers * 4))
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = executor.map(
+                parse_cached, todo, itertools.repeat(app), chunksize=chunksize
+            )
+            for i, (parsed_blocks, entry) in enumerate(parsed):
+                print(f"Parsing {i} of {total}", end="\r")
+                filename = todo[i]
+                keep[filename] = entry
+                for name, block in parsed_blocks.items():
+                    if block is not None:
+                        blocks[name].append(add_filename(block, filename))
+        print()
+    print(f"Parsed {len(todo)} files, {len(files) - len(todo)} were cached")
+
+    frames = {}
+    for name, columns in frame_columns.items():
+        columns = dict(columns, filename="category")
+        frames[name] = concat_blocks(columns, blocks[name])
+
+        # Add the rows we still want from the cache
+        if cached_frames is not None:
+            frames[name] = concat_cached(cached_frames[name], frames[name], cached)
+
+    # Only write the cache if something changed
+    if cache and (todo or keep != index):
+        save_cache(cache, keep, frames)
+
+    # Rows are in the order of the files we were given
+    order = {filename: i for i, filename in enumerate(files)}
+    frames = {name: sort_by_file(df, order) for name, df in frames.items()}
+    return frames["ebpf"], frames["runs"], frames["foms"]
+
+
+def concat_cached(cached, df, files):
+    """
+    Add cached rows for unchanged files to newly parsed rows.
+    """
+    cached = cached[cached.filename.isin(files)]
+    frames = [x for x in [cached, df] if x.shape[0] > 0]
+    if not frames:
+        return df
+    return concat_frames(frames)
+
+
+def sort_by_file(df, order):
+    """
+    Sort rows by file (keeping the order within a file) and drop the filename.
+    """
+    lookup = numpy.array([order.get(x, -1) for x in df.filename.cat.categories])
+    positions = lookup[df.filename.cat.codes.to_numpy()]
+    df = df.iloc[numpy.argsort(positions, kind="stable")]
+    df = df.drop(columns=["filename"]).reset_index(drop=True)
+
+    # Files that are gone can leave categories behind
+    for name in df.select_dtypes("category"):
+        df[name] = df[name].cat.remove_unused_categories()
+    return df
 
 
 if __name__ == "__main__":
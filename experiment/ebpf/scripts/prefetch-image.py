@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Warm the page cache for a container image from a prefetch manifest, written by
+# time-calls.py --image <sif> --manifest <json>. Run this before launching so the
+# container does not lazy load its pages from storage.
+# Usage:
+#   python3 prefetch-image.py --manifest lammps-manifest.json
+#   python3 prefetch-image.py --manifest lammps-manifest.json --drop
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Prefetch container image pages into the page cache",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--manifest", help="prefetch manifest (json)", required=True)
+    parser.add_argument(
+        "--read",
+        help="read the ranges (blocks until done) instead of asking the kernel to readahead",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--drop",
+        help="drop the image from the page cache instead (to measure a cold start)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--force",
+        help="prefetch even if the image changed since the manifest was written",
+        action="store_true",
+        default=False,
+    )
+    return parser
+
+
+def prefetch(image, read=False, chunk=1 << 20):
+    """
+    Prefetch the ranges of one image, in the order they were first read.
+    """
+    fd = os.open(image["image"], os.O_RDONLY)
+    total = 0
+    try:
+        for offset, length, *_ in image["ranges"]:
+            if read:
+                remaining = length
+                while remaining > 0:
+                    data = os.pread(
+                        fd, min(chunk, remaining), offset + length - remaining
+                    )
+                    if not data:
+                        break
+                    remaining -= len(data)
+            else:
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+            total += length
+    finally:
+        os.close(fd)
+    return total
+
+
+def drop(image):
+    """
+    Drop an image from the page cache.
+    """
+    fd = os.open(image["image"], os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    with open(args.manifest) as fd:
+        images = json.loads(fd.read())
+
+    for image in images:
+        path = image["image"]
+        if not os.path.exists(path):
+            sys.exit(f"Image {path} does not exist.")
+
+        # The offsets are only good for the same image
+        st = os.stat(path)
+        if (st.st_size != image["size"] or st.st_mtime != image["mtime"]) and not (
+            args.force
+        ):
+            sys.exit(f"Image {path} changed since the manifest was written.")
+
+        if args.drop:
+            drop(image)
+            print(f"Dropped {path} from the page cache.")
+            continue
+
+        start = time.time()
+        total = prefetch(image, read=args.read)
+        end = time.time()
+        print(
+            f"Prefetched {total} bytes in {len(image['ranges'])} ranges of {path} in {end-start} seconds."
+        )
+
+
+if __name__ == "__main__":
+    main()
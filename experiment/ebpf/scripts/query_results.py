@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+# Query results parsed by plot-results.py (its .parse-cache) with SQL.
+# We use DuckDB if it is installed, and otherwise build a SQLite database
+# (with indexes) next to the cache, that is only built again when it changes.
+#
+# Usage:
+#   python3 query_results.py --results ../../results/test-1 tables
+#   python3 query_results.py --results ../../results/test-1 sql \
+#     "SELECT experiment, ranks, sum(time_nsecs) FROM ebpf GROUP BY 1, 2"
+#   python3 query_results.py --results ../../results/test-1 growth \
+#     --experiment singularity --from 28 --to 56
+#
+# Or from Python:
+#   import query_results
+#   con = query_results.connect("../../results/test-1")
+#   df = query_results.query(con, "SELECT count(*) FROM ebpf WHERE ranks = ?", [56])
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import pandas
+
+# Columnar and faster to aggregate, but we don't require it
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tables (frames in the parse cache) and the indexes we want for SQLite
+# The last has time_nsecs, so function times by size are found in the index
+indexes = {
+    "ebpf": [
+        ["function", "experiment", "ranks", "iteration"],
+        ["experiment", "ranks", "iteration"],
+        ["app", "experiment", "ranks", "function", "iteration", "time_nsecs"],
+    ],
+    "runs": [["experiment", "ranks", "iteration"]],
+    "foms": [["name", "experiment", "ranks", "iteration"]],
+}
+
+# Which functions grew most (mean time per run) from one size to another.
+# A run without a function spent no time in it (as in the overhead waterfall
+# of plot-results.py), so we divide by all runs of the size, not the rows.
+growth_sql = """
+WITH rows AS (
+    SELECT function, ranks, iteration, time_nsecs
+    FROM ebpf
+    WHERE app = ? AND experiment = ? AND ranks IN (?, ?)
+),
+runs AS (
+    SELECT ranks, count(DISTINCT iteration) AS runs
+    FROM rows
+    GROUP BY ranks
+),
+means AS (
+    SELECT
+        function,
+        sum(CASE WHEN ranks = ? THEN time_nsecs ELSE 0 END) * 1.0
+            / (SELECT runs FROM runs WHERE ranks = ?) AS mean_nsecs_from,
+        sum(CASE WHEN ranks = ? THEN time_nsecs ELSE 0 END) * 1.0
+            / (SELECT runs FROM runs WHERE ranks = ?) AS mean_nsecs_to
+    FROM rows
+    GROUP BY function
+)
+SELECT
+    function,
+    mean_nsecs_from,
+    mean_nsecs_to,
+    mean_nsecs_to - mean_nsecs_from AS growth_nsecs,
+    mean_nsecs_to / NULLIF(mean_nsecs_from, 0) AS ratio
+FROM means
+WHERE mean_nsecs_from IS NOT NULL AND mean_nsecs_to IS NOT NULL
+ORDER BY growth_nsecs DESC
+LIMIT ?
+"""
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Query parsed results with SQL",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--results",
+        help="directory with raw results data (parsed by plot-results.py)",
+        default=os.path.join(here, "results", "test-1"),
+    )
+    parser.add_argument(
+        "--cache",
+        help="parse cache of plot-results.py (defaults to .parse-cache in --results)",
+    )
+    parser.add_argument(
+        "--db",
+        help="SQLite database to build (defaults to results.sqlite in the cache)",
+    )
+    parser.add_argument(
+        "--engine",
+        help="query engine (defaults to duckdb if it is installed)",
+        choices=["duckdb", "sqlite"],
+    )
+    parser.add_argument("--out", help="write the result to this csv file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("tables", help="show the tables and their columns")
+    sql = subparsers.add_parser("sql", help="run a SQL query")
+    sql.add_argument("query", help="SQL (tables are ebpf, runs and foms)")
+
+    growth = subparsers.add_parser(
+        "growth", help="functions that grew most from one size (ranks) to another"
+    )
+    growth.add_argument("--app", help="application", default="lammps")
+    growth.add_argument("--experiment", help="experiment", default="singularity")
+    growth.add_argument(
+        "--from", dest="start", help="ranks to start from", type=int, required=True
+    )
+    growth.add_argument(
+        "--to", dest="end", help="ranks to end at", type=int, required=True
+    )
+    growth.add_argument("--limit", help="number of functions", type=int, default=20)
+    return parser
+
+
+def read_index(cache):
+    """
+    Read the index of a parse cache, and get a digest of it (and of the
+    indexes, so SQLite is built again when they change).
+    """
+    index_file = os.path.join(cache, "index.json")
+    if not os.path.exists(index_file):
+        sys.exit(f"There is no parse cache in {cache}, run plot-results.py first.")
+    with open(index_file, "rb") as fd:
+        content = fd.read()
+    digest = hashlib.sha256(content)
+    digest.update(json.dumps(indexes).encode("utf-8"))
+    return json.loads(content), digest.hexdigest()
+
+
+def load_frames(cache, index):
+    """
+    Load the frames from a parse cache.
+    """
+    frames = {}
+    for name in indexes:
+        path = os.path.join(cache, f"{name}.{index['format']}")
+        if not os.path.exists(path):
+            sys.exit(f"{path} is missing, run plot-results.py again.")
+        if index["format"] == "parquet":
+            frames[name] = pandas.read_parquet(path)
+        else:
+            frames[name] = pandas.read_pickle(path)
+
+    # The filename is only for the cache to drop files that changed
+    return {name: df.drop(columns=["filename"]) for name, df in frames.items()}
+
+
+def build_sqlite(db, frames, digest):
+    """
+    Build a SQLite database from the frames, replacing the last one when done.
+    """
+    tmp = f"{db}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    con = sqlite3.connect(tmp)
+    con.execute("PRAGMA journal_mode = OFF")
+    con.execute("PRAGMA synchronous = OFF")
+    for name, df in frames.items():
+        df.to_sql(name, con, index=False, chunksize=100000)
+
+    # Indexes are faster to build after the rows are in
+    for name, columns in indexes.items():
+        for i, keys in enumerate(columns):
+            con.execute(f"CREATE INDEX {name}_{i} ON {name} ({', '.join(keys)})")
+    con.execute("CREATE TABLE meta (digest TEXT)")
+    con.execute("INSERT INTO meta VALUES (?)", [digest])
+    con.execute("ANALYZE")
+    con.commit()
+    con.close()
+    os.replace(tmp, db)
+
+
+def get_digest(db):
+    """
+    Get the digest of the parse cache a SQLite database was built from.
+    """
+    if not os.path.exists(db):
+        return None
+    con = sqlite3.connect(db)
+    try:
+        return con.execute("SELECT digest FROM meta").fetchone()[0]
+    except sqlite3.Error:
+        return None
+    finally:
+        con.close()
+
+
+def connect(results=None, cache=None, db=None, engine=None):
+    """
+    Connect to parsed results, with tables ebpf, runs and foms.
+
+    DuckDB queries the frames in memory. SQLite has a database file next to
+    the cache, and it is only built again when the cache changed.
+    """
+    if not cache:
+        cache = os.path.join(results, ".parse-cache")
+    cache = os.path.abspath(cache)
+    engine = engine or ("duckdb" if duckdb is not None else "sqlite")
+    index, digest = read_index(cache)
+
+    if engine == "duckdb":
+        if duckdb is None:
+            sys.exit("duckdb is not installed, use --engine sqlite.")
+        con = duckdb.connect()
+        for name, df in load_frames(cache, index).items():
+            con.register(name, df)
+        return con
+
+    db = db or os.path.join(cache, "results.sqlite")
+    if get_digest(db) != digest:
+        print(f"Building {db}", file=sys.stderr)
+        build_sqlite(db, load_frames(cache, index), digest)
+    return sqlite3.connect(db)
+
+
+def query(con, sql, params=None):
+    """
+    Run a query and get the result as a data frame.
+    """
+    if duckdb is not None and isinstance(con, duckdb.DuckDBPyConnection):
+        return con.execute(sql, params or []).df()
+    return pandas.read_sql_query(sql, con, params=params)
+
+
+def growth(con, experiment, start, end, app="lammps", limit=20):
+    """
+    Functions that grew most in mean time per run from start to end ranks.
+    """
+    params = [app, experiment, start, end, start, start, end, end, limit]
+    return query(con, growth_sql, params)
+
+
+def tables(con):
+    """
+    Get the tables and their columns (types are per engine)
+    """
+    rows = []
+    for name in indexes:
+        df = query(con, f"SELECT * FROM {name} LIMIT 0")
+        rows.append({"table": name, "columns": ", ".join(df.columns)})
+    return pandas.DataFrame(rows)
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    con = connect(args.results, args.cache, args.db, args.engine)
+
+    start = time.time()
+    if args.command == "tables":
+        df = tables(con)
+    elif args.command == "growth":
+        df = growth(con, args.experiment, args.start, args.end, args.app, args.limit)
+    else:
+        df = query(con, args.query)
+    end = time.time()
+
+    if args.out:
+        df.to_csv(args.out, index=False)
+    print(df.to_string(index=False))
+    print(f"{df.shape[0]} rows in {end-start:.3f} seconds", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
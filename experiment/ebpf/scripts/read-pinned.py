@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# Read the tables pinned by time-calls.py --pin <name> from another process.
+# This works while the run is going (live) or after the collector exits (or dies).
+# Usage:
+#   sudo -E python3 read-pinned.py list lammps-1
+#   sudo -E python3 read-pinned.py snapshot lammps-1
+#   sudo -E python3 read-pinned.py export lammps-1 --out lammps-1.json
+#   sudo -E python3 read-pinned.py reset lammps-1
+#   sudo -E python3 read-pinned.py remove lammps-1
+
+import argparse
+import json
+import os
+import sys
+
+from bcc import BPF
+
+from collector import (
+    get_rank,
+    isolation_structs,
+    mpi_structs,
+    pin_root,
+    pinned_tables,
+    stats_structs,
+)
+
+# The structs for the pinned tables, the same as in time-calls.py
+bpf_header = stats_structs + mpi_structs + isolation_structs
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Read tables pinned by time-calls.py --pin",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "command",
+        help="what to do with the pinned tables",
+        choices=["list", "snapshot", "export", "reset", "remove"],
+    )
+    parser.add_argument("name", help="name of the run given to --pin")
+    parser.add_argument("--out", help="file to export to (defaults to the terminal)")
+    parser.add_argument(
+        "--mpi-functions",
+        dest="mpi_functions",
+        help="comma separated MPI functions given to time-calls.py, to name mpi_stats rows",
+    )
+    return parser
+
+
+def load_tables(path):
+    """
+    Load the pinned tables we know about from a run directory.
+    """
+    text = bpf_header
+    names = []
+    for name, declaration in pinned_tables.items():
+        pin = os.path.join(path, name)
+        if os.path.exists(pin):
+            text += declaration % pin + "\n"
+            names.append(name)
+    if not names:
+        sys.exit(f"There are no tables we know how to read in {path}")
+    program = BPF(text=text)
+    return {name: program.get_table(name) for name in names}
+
+
+def snapshot(tables, mpi_functions=None):
+    """
+    Take a snapshot of function times, in the same format as time-calls.py
+    """
+    rows = []
+    ranks = {}
+
+    def add_row(func, tgid, v):
+        if tgid not in ranks:
+            ranks[tgid] = get_rank(tgid)
+        rows.append(
+            {
+                "func": func,
+                "tgid": tgid,
+                "rank": ranks[tgid],
+                "count": v.freq,
+                "time_nsecs": v.time,
+            }
+        )
+
+    if "stats" in tables:
+        for k, v in tables["stats"].items():
+            add_row(BPF.sym(k.ip, -1).decode("utf-8"), k.tgid, v)
+
+    if "iso_stats" in tables:
+        for k, v in tables["iso_stats"].items():
+            add_row(f"isolation:{BPF.sym(k.ip, -1).decode('utf-8')}", k.tgid, v)
+
+    if "mpi_stats" in tables:
+        for k, v in tables["mpi_stats"].items():
+            func = f"mpi:{k.id}"
+            if mpi_functions and k.id < len(mpi_functions):
+                func = mpi_functions[k.id]
+            add_row(func, k.tgid, v)
+
+    totals = {}
+    for row in rows:
+        if row["func"] not in totals:
+            totals[row["func"]] = {"func": row["func"], "count": 0, "time_nsecs": 0}
+        totals[row["func"]]["count"] += row["count"]
+        totals[row["func"]]["time_nsecs"] += row["time_nsecs"]
+
+    # Syscalls are summed per CPU, there is no tgid
+    if "syscalls" in tables:
+        from bcc.syscall import syscall_name
+
+        for k, v in tables["syscalls"].items():
+            count = sum(cpu.freq for cpu in v)
+            if count == 0:
+                continue
+            func = f"syscall:{syscall_name(k.value).decode('utf-8')}"
+            totals[func] = {
+                "func": func,
+                "syscall": k.value,
+                "count": count,
+                "time_nsecs": sum(cpu.time for cpu in v),
+            }
+
+    tracked = []
+    if "tracked" in tables:
+        tracked = sorted(k.value for k in tables["tracked"].keys())
+    return {"results": list(totals.values()), "ranks": rows, "tracked": tracked}
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    path = os.path.join(pin_root, args.name)
+    if not os.path.exists(path):
+        sys.exit(f"{path} does not exist, was the run started with --pin {args.name}?")
+
+    if args.command == "list":
+        for name in sorted(os.listdir(path)):
+            known = "" if name in pinned_tables else " (not readable here)"
+            print(f"{name}{known}")
+        return
+
+    # Unpin everything, the maps go away once nothing else holds them
+    if args.command == "remove":
+        for name in os.listdir(path):
+            os.unlink(os.path.join(path, name))
+        os.rmdir(path)
+        print(f"Removed {path}")
+        return
+
+    tables = load_tables(path)
+
+    if args.command == "reset":
+        for name, table in tables.items():
+            if name == "tracked":
+                continue
+            table.clear()
+            print(f"Reset {name}")
+        return
+
+    mpi_functions = None
+    if args.mpi_functions:
+        mpi_functions = args.mpi_functions.split(",")
+    result = snapshot(tables, mpi_functions)
+
+    if args.command == "export":
+        if args.out:
+            with open(args.out, "w") as fd:
+                fd.write(json.dumps(result, indent=4))
+            print(f"Exported {len(result['results'])} functions to {args.out}")
+        else:
+            print(json.dumps(result, indent=4))
+        return
+
+    print(f"Tracking {len(result['tracked'])} processes")
+    print("%-36s %8s %16s" % ("FUNC", "COUNT", "TIME (nsecs)"))
+    for row in result["results"]:
+        print("%-36s %8s %16s" % (row["func"], row["count"], row["time_nsecs"]))
+    print("\n=== RESULTS START")
+    print(json.dumps(result["results"]))
+    print("=== RESULTS END")
+    print("\n=== RANKS START")
+    print(json.dumps(result["ranks"]))
+    print("=== RANKS END")
+
+
+if __name__ == "__main__":
+    main()
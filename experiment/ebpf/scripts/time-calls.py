@@ -3,39 +3,104 @@
 # Run an ebpf program by name, and wait for it to finish
 # Usage:
 #   sudo -E python3 time-calls.py --pattern do_sys* <program> <options> <args>
+#   sudo -E python3 time-calls.py --syscalls <program> <options> <args>
+#   sudo -E python3 time-calls.py --sched <program> <options> <args>
+#   sudo -E python3 time-calls.py --mpi <program> <options> <args>
+#   sudo -E python3 time-calls.py --startup <program> <options> <args>
+#   sudo -E python3 time-calls.py --image <sif> --manifest <json> <program> <options> <args>
+#   sudo -E python3 time-calls.py --vfs <program> <options> <args>
+#   sudo -E python3 time-calls.py --isolation <program> <options> <args>
+#   sudo -E python3 time-calls.py --poll <program> <options> <args>
+#   sudo -E python3 time-calls.py --memory <program> <options> <args>
+#   sudo -E python3 time-calls.py --contention <program> <options> <args>
+#   sudo -E python3 time-calls.py --interference <program> <options> <args>
+#   sudo -E python3 time-calls.py --pin lammps-1 <program> <options> <args>
+#   sudo -E python3 time-calls.py --log-dir ./logs --timeout 3600 <program> <options> <args>
 
 import argparse
+import asyncio
+import codecs
+import collections
+import logging
+import logging.handlers
 import os
+import signal
 import subprocess
 import sys
+import time
 import json
 
 from bcc import BPF
 
+from collector import (
+    get_rank,
+    isolation_structs,
+    mpi_structs,
+    pin_root,
+    pinned_tables,
+    stats_structs,
+    summarize_ranks,
+)
+
 # This is the BPF program
 # We are basically keeping track of start and end times
 # and that way we can return an accumulated time.
 # This is based on this example: https://github.com/iovisor/bcc/blob/master/tools/funclatency.py
 # plus random Google searching because I'm a C idiot
-bpf_text = """
+# The structs for pinned tables are shared with read-pinned.py (collector.py)
+bpf_text = (
+    """
 #include <uapi/linux/ptrace.h>
-
-struct stats_t {
-    u64 time;
-    u64 freq;
+"""
+    + stats_structs
+    + """
+struct exec_t {
+    u32 tgid;
 };
+
 BPF_HASH(start, u32);
 BPF_HASH(ipaddr, u32);
-BPF_HASH(stats, u64, struct stats_t);
+BPF_HASH(stats, struct key_t, struct stats_t);
+
+// Processes (thread group ids) we follow. We seed this with the pid we
+// launch (and any children that exist already) and add forks as they happen.
+BPF_HASH(tracked, u32, u32);
+
+// Tell userspace when a tracked process execs, so it can read the rank
+BPF_PERF_OUTPUT(execs);
+
+TRACEPOINT_PROBE(sched, sched_process_fork) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    u32 child = args->child_pid;
+    u32 one = 1;
+    tracked.update(&child, &one);
+    return 0;
+}
+
+TRACEPOINT_PROBE(sched, sched_process_exec) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct exec_t event = {};
+    event.tgid = tgid;
+    execs.perf_submit(args, &event, sizeof(event));
+    return 0;
+}
 
 int start_timing(struct pt_regs *ctx) {
     u64 pid_tgid = bpf_get_current_pid_tgid();
 
-    // This should be the pid of the task group
-    // I think this is what subprocess gives back
+    // This is the thread id, and the start time is per thread
     u32 pid = pid_tgid;
+    u32 tgid = pid_tgid >> 32;
 
-    FILTER
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
 
     u64 ts = bpf_ktime_get_ns();
     u64 ip = PT_REGS_IP(ctx);
@@ -60,10 +125,12 @@ int stop_timing(struct pt_regs *ctx) {
     delta = bpf_ktime_get_ns() - *tsp;
     start.delete(&pid);
 
-    u64 ip, *ipp = ipaddr.lookup(&pid);
+    u64 *ipp = ipaddr.lookup(&pid);
     if (ipp) {
-        ip = *ipp;
-        struct stats_t *stat = stats.lookup(&ip);
+        struct key_t key = {};
+        key.tgid = pid_tgid >> 32;
+        key.ip = *ipp;
+        struct stats_t *stat = stats.lookup(&key);
         if (stat) {
             stat->time += delta;
             stat->freq++;
@@ -71,7 +138,7 @@ int stop_timing(struct pt_regs *ctx) {
             struct stats_t s = {};
             s.time = delta;
             s.freq = 1;
-            stats.update(&ip, &s);
+            stats.update(&key, &s);
         }
         ipaddr.delete(&pid);
     }
@@ -79,149 +146,3101 @@ int stop_timing(struct pt_regs *ctx) {
     return 0;
 }
 """
+)
 
+# Syscall timing with the raw_syscalls tracepoints. This covers every syscall
+# (not just those that go through do_sys_* helpers) and raw tracepoints are
+# cheaper than a kprobe/kretprobe pair. Stats are keyed by syscall number,
+# and are per-CPU so we don't contend on the same counter.
+syscall_text = """
+struct syscall_start_t {
+    u64 ts;
+    u32 nr;
+};
 
-def get_matches(pattern):
-    program = BPF(text=bpf_text)
-    program.attach_kprobe(event_re=pattern, fn_name="start_timing")
-    program.attach_kretprobe(event_re=pattern, fn_name="stop_timing")
+BPF_HASH(syscall_start, u32, struct syscall_start_t);
+BPF_PERCPU_ARRAY(syscalls, struct stats_t, 1024);
 
-    # This tells us the number of kprobes we match
-    matched = program.num_open_kprobes()
-    print(matched)
+static int syscalls_enter(struct bpf_raw_tracepoint_args *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    u32 tgid = pid_tgid >> 32;
 
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
 
-def add_filter(pid):
-    """
-    Add a filter to a tgid (thread group id) based on
-    a program pid. A group of pids can belong to a tgid,
-    and usually the first is the tgid. We can use a function
-    to derive it.
-    """
-    global bpf_text
-    bpf_text = bpf_text.replace("FILTER", f"if (pid != {pid})" + "{ return 0; }")
+    // args are the pt_regs and the syscall number
+    struct syscall_start_t s = {};
+    s.ts = bpf_ktime_get_ns();
+    s.nr = ctx->args[1];
+    syscall_start.update(&pid, &s);
+    return 0;
+}
 
+static int syscalls_exit(struct bpf_raw_tracepoint_args *ctx) {
+    u32 pid = bpf_get_current_pid_tgid();
 
-def get_parser():
-    parser = argparse.ArgumentParser(
-        description="Time functions and print time spent in each function",
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-    )
-    parser.add_argument("--pid", type=int, help="trace a single PID only")
-    parser.add_argument(
-        "-p", "--pattern", help="search expression for functions", default="do_sys*"
-    )
-    return parser
+    // This also filters to tracked processes
+    struct syscall_start_t *s = syscall_start.lookup(&pid);
+    if (s == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - s->ts;
+    u32 nr = s->nr;
+    syscall_start.delete(&pid);
 
+    struct stats_t *stat = syscalls.lookup(&nr);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+    }
+    return 0;
+}
+"""
 
-def get_pid(program):
-    """
-    Get the pid(s) of a program by name.
+# Scheduler accounting with sched_switch and sched_wakeup. When a tracked thread
+# is switched out we record why (blocked, or preempted while still runnable)
+# and add the time until it is switched back in to the off-CPU time of its
+# process. Time spent runnable but waiting for a CPU (after a wakeup or a
+# preemption) goes into a log2 histogram (usecs) per process.
+sched_text = """
+#define REASON_PREEMPTED 0
+#define REASON_BLOCKED 1
 
-    We could use psutil for this, but I would
-    rather not install an extra thing.
-    """
-    pid = subprocess.check_output(["pidof", program])
-    if not pid:
-        raise ValueError(f"Cannot get pid for {program}")
-    pid = pid.decode("utf-8").strip().split(" ")
-    return [int(x) for x in pid]
+struct offcpu_t {
+    u64 ts;
+    u32 tgid;
+    u32 reason;
+};
 
+struct offcpu_key_t {
+    u32 tgid;
+    u32 reason;
+};
 
-def pid_exists(pid):
-    """
-    Check if a pid exists in the current process table.
+struct runq_key_t {
+    u32 tgid;
+    u64 slot;
+};
 
-    This is exactly how psutil words, minus the edge cases.
-    """
-    try:
-        os.kill(pid, 0)
-    except ProcessLookupError:
-        return False
-    except PermissionError:
-        return True
-    # (EINVAL, EPERM, ESRCH)
-    else:
-        return True
+BPF_HASH(offcpu_start, u32, struct offcpu_t);
+BPF_HASH(runq_start, u32, u64);
+BPF_HASH(offcpu, struct offcpu_key_t, struct stats_t);
+BPF_HASH(runq_total, u32, struct stats_t);
+BPF_HISTOGRAM(runq, struct runq_key_t);
 
+TRACEPOINT_PROBE(sched, sched_wakeup) {
+    u32 pid = args->pid;
 
-def main():
-    """
-    Run the ebpf program. Usage:
+    // Only threads we saw go off-CPU are ours
+    if (offcpu_start.lookup(&pid) == 0) {
+        return 0;
+    }
+    u64 ts = bpf_ktime_get_ns();
+    runq_start.update(&pid, &ts);
+    return 0;
+}
 
-    sudo -E python3 time-calls.py sleep 10
-    """
-    parser = get_parser()
-    args, command = parser.parse_known_args()
+TRACEPOINT_PROBE(sched, sched_switch) {
+    u64 ts = bpf_ktime_get_ns();
 
-    # If we don't have a command or pid, no go
-    if not command and not args.pid:
-        sys.exit("We need a --pid or command to follow the script, bro-shizzle.")
+    // This runs before the switch, so the current task is prev
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    u32 prev = args->prev_pid;
+    if (prev != 0 && tracked.lookup(&tgid)) {
+        struct offcpu_t o = {};
+        o.ts = ts;
+        o.tgid = tgid;
 
-    # NOTE: this does add some overhead to the application, but it depends how you run it
-    # By process (e.g., wrapping lmp and not mpirun) adds a few seconds vs. mpirun
-    # is comparable
-    if args.pid is None and command:
-        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        pid = p.pid
-    else:
-        pid = args.pid
+        // Interruptible or uninterruptible sleep is blocked, otherwise
+        // we are still runnable and are waiting in the run queue
+        if (args->prev_state & 3) {
+            o.reason = REASON_BLOCKED;
+        } else {
+            o.reason = REASON_PREEMPTED;
+            runq_start.update(&prev, &ts);
+        }
+        offcpu_start.update(&prev, &o);
+    }
 
-    add_filter(pid)
-    print(f"👀️ Watching pid {pid}...")
+    u32 next = args->next_pid;
+    struct offcpu_t *op = offcpu_start.lookup(&next);
+    if (op == 0) {
+        return 0;
+    }
+    struct offcpu_key_t key = {};
+    key.tgid = op->tgid;
+    key.reason = op->reason;
+    u64 delta = ts - op->ts;
+    offcpu_start.delete(&next);
 
-    # Load the ebpf program
-    program = BPF(text=bpf_text)
+    struct stats_t *stat = offcpu.lookup(&key);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+    } else {
+        struct stats_t s = {};
+        s.time = delta;
+        s.freq = 1;
+        offcpu.update(&key, &s);
+    }
 
-    # patterns should be regular expression oriented
-    program.attach_kprobe(event_re=args.pattern, fn_name="start_timing")
-    program.attach_kretprobe(event_re=args.pattern, fn_name="stop_timing")
+    u64 *rqp = runq_start.lookup(&next);
+    if (rqp == 0) {
+        return 0;
+    }
+    delta = ts - *rqp;
+    runq_start.delete(&next);
 
-    # This tells us the number of kprobes we match
-    matched = program.num_open_kprobes()
+    struct runq_key_t hkey = {};
+    hkey.tgid = key.tgid;
+    hkey.slot = bpf_log2l(delta / 1000);
+    runq.increment(hkey);
 
-    # We got a bad, bad pattern!
-    if matched == 0:
-        sys.exit('0 functions matched by "{args.pattern}". Exiting.')
+    stat = runq_total.lookup(&key.tgid);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+    } else {
+        struct stats_t s = {};
+        s.time = delta;
+        s.freq = 1;
+        runq_total.update(&key.tgid, &s);
+    }
+    return 0;
+}
+"""
 
-    # We have to divide by two since we have a start/stop
-    number_functions = int(matched / 2)
-    print(f'Timing {number_functions} functions for "{args.pattern}')
+# MPI timing with uprobes on the MPI library each rank loads. We give each
+# function an id (the handlers are generated below) since the user space
+# address differs per process. Start times are keyed by thread and function,
+# so MPI_Wait calling into the progress engine does not clobber the start.
+mpi_text = mpi_structs + """
+struct mpi_start_key_t {
+    u32 pid;
+    u32 id;
+};
 
-    # I'm not sure what overhead this adds
-    p.wait()
+BPF_HASH(mpi_start, struct mpi_start_key_t, u64);
+BPF_HASH(mpi_stats, struct mpi_key_t, struct stats_t);
 
-    # Print output - for the experiments we will save it to file
-    # Better would be to open an sqlite database, and save to a table
-    # based on the program, pid, and iteration.
-    out, err = p.communicate()
-    if p.returncode == 0:
-        out = out.decode("utf-8")
-        print(out)
-        print("Run was successful.")
-    else:
-        err = err.decode("utf-8")
-        print(err)
-        print("Run was not successful.")
+static int mpi_enter(struct pt_regs *ctx, u32 id) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 tgid = pid_tgid >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct mpi_start_key_t key = {};
+    key.pid = pid_tgid;
+    key.id = id;
+    u64 ts = bpf_ktime_get_ns();
+    mpi_start.update(&key, &ts);
+    return 0;
+}
 
-    print()
-    print("%-36s %8s %16s" % ("FUNC", "COUNT", "TIME (nsecs)"))
+static int mpi_exit(struct pt_regs *ctx, u32 id) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    struct mpi_start_key_t start_key = {};
+    start_key.pid = pid_tgid;
+    start_key.id = id;
+    u64 *tsp = mpi_start.lookup(&start_key);
+    if (tsp == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - *tsp;
+    mpi_start.delete(&start_key);
 
-    # Get a table from the program to print to the terminal
-    stats = program.get_table("stats")
-    results = []
-    for k, v in stats.items():
-        results.append(
-            {
-                "func": BPF.sym(k.value, -1).decode("utf-8"),
-                "count": v.freq,
-                "time_nsecs": v.time,
-            }
+    struct mpi_key_t key = {};
+    key.tgid = pid_tgid >> 32;
+    key.id = id;
+    struct stats_t *stat = mpi_stats.lookup(&key);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+    } else {
+        struct stats_t s = {};
+        s.time = delta;
+        s.freq = 1;
+        mpi_stats.update(&key, &s);
+    }
+    return 0;
+}
+"""
+
+mpi_handler_template = """
+int mpi_enter_%(id)s(struct pt_regs *ctx) { return mpi_enter(ctx, %(id)s); }
+int mpi_exit_%(id)s(struct pt_regs *ctx) { return mpi_exit(ctx, %(id)s); }
+"""
+
+# MPI entry points to time, and the progress engine (opal_progress is in
+# libopen-pal for Open MPI, MPID_Progress_wait in libmpi for MPICH)
+mpi_functions = [
+    "MPI_Allreduce",
+    "MPI_Reduce",
+    "MPI_Bcast",
+    "MPI_Barrier",
+    "MPI_Alltoall",
+    "MPI_Allgather",
+    "MPI_Send",
+    "MPI_Recv",
+    "MPI_Isend",
+    "MPI_Irecv",
+    "MPI_Wait",
+    "MPI_Waitall",
+    "MPI_Waitany",
+    "MPI_Sendrecv",
+    "MPI_Init",
+    "MPI_Finalize",
+    "opal_progress",
+    "MPID_Progress_wait",
+]
+
+# Libraries (by name in /proc/<pid>/maps) that we look for MPI functions in
+mpi_libraries = ["libmpi.so", "libopen-pal.so", "libmpich.so"]
+
+# Seconds between scans of a pid without MPI libraries
+mpi_rescan_interval = 5
+
+# Startup tracing, from exec to the first application syscall. After a tracked
+# process execs, we send every syscall the loader makes (opens, stats, mmaps,
+# etc.) to userspace with its path, time and return value. The first syscall
+# that is not a loader syscall ends the window (until the next exec, e.g., the
+# singularity runtime exec'ing the application). The startup_syscalls array
+# is filled from userspace, see startup_syscalls below.
+startup_text = """
+#define STARTUP_EXEC 0
+#define STARTUP_CALL 1
+#define STARTUP_END 2
+
+#define STARTUP_LOADER 1
+#define STARTUP_PATH_ARG1 2
+#define STARTUP_PATH_ARG2 4
+
+struct startup_t {
+    u64 exec_ts;
+    u32 done;
+};
+
+struct startup_call_t {
+    u64 ts;
+    u32 nr;
+    char path[256];
+};
+
+struct startup_event_t {
+    u32 tgid;
+    u32 type;
+    u32 nr;
+    s64 ret;
+    u64 ts;
+    u64 delta;
+    char path[256];
+};
+
+BPF_HASH(startup, u32, struct startup_t);
+BPF_HASH(startup_calls, u32, struct startup_call_t);
+BPF_ARRAY(startup_syscalls, u32, 1024);
+BPF_PERF_OUTPUT(startup_events);
+
+int startup_exec(struct bpf_raw_tracepoint_args *ctx) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    u64 ts = bpf_ktime_get_ns();
+
+    // Each exec opens the window again, we keep the time of the first
+    struct startup_t *st = startup.lookup(&tgid);
+    if (st) {
+        st->done = 0;
+    } else {
+        struct startup_t s = {};
+        s.exec_ts = ts;
+        startup.update(&tgid, &s);
+    }
+    struct startup_event_t event = {};
+    event.tgid = tgid;
+    event.type = STARTUP_EXEC;
+    event.ts = ts;
+    startup_events.perf_submit(ctx, &event, sizeof(event));
+    return 0;
+}
+
+static int startup_enter(struct bpf_raw_tracepoint_args *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    u32 tgid = pid_tgid >> 32;
+
+    struct startup_t *st = startup.lookup(&tgid);
+    if (st == 0 || st->done) {
+        return 0;
+    }
+
+    u32 nr = ctx->args[1];
+    u32 *flags = startup_syscalls.lookup(&nr);
+    u64 ts = bpf_ktime_get_ns();
+
+    // The first application syscall, startup is over
+    if (flags == 0 || (*flags & STARTUP_LOADER) == 0) {
+        st->done = 1;
+        struct startup_event_t event = {};
+        event.tgid = tgid;
+        event.type = STARTUP_END;
+        event.nr = nr;
+        event.ts = ts;
+        startup_events.perf_submit(ctx, &event, sizeof(event));
+        return 0;
+    }
+
+    struct startup_call_t call = {};
+    call.ts = ts;
+    call.nr = nr;
+
+    // The syscall args are in the user registers (the first raw arg)
+    struct pt_regs *regs = (struct pt_regs *)ctx->args[0];
+    const char *path = 0;
+    if (*flags & STARTUP_PATH_ARG1) {
+        bpf_probe_read_kernel(&path, sizeof(path), &PT_REGS_PARM1(regs));
+    } else if (*flags & STARTUP_PATH_ARG2) {
+        bpf_probe_read_kernel(&path, sizeof(path), &PT_REGS_PARM2(regs));
+    }
+    if (path) {
+        bpf_probe_read_user_str(&call.path, sizeof(call.path), path);
+    }
+    startup_calls.update(&pid, &call);
+    return 0;
+}
+
+static int startup_exit(struct bpf_raw_tracepoint_args *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+
+    struct startup_call_t *call = startup_calls.lookup(&pid);
+    if (call == 0) {
+        return 0;
+    }
+    struct startup_event_t event = {};
+    event.tgid = pid_tgid >> 32;
+    event.type = STARTUP_CALL;
+    event.nr = call->nr;
+    event.ret = ctx->args[1];
+    event.ts = call->ts;
+    event.delta = bpf_ktime_get_ns() - call->ts;
+    bpf_probe_read_kernel(&event.path, sizeof(event.path), call->path);
+    startup_calls.delete(&pid);
+    startup_events.perf_submit(ctx, &event, sizeof(event));
+    return 0;
+}
+"""
+
+# Syscalls the dynamic linker makes before the application runs. The value
+# says if the syscall has a path, and in which argument.
+startup_syscalls = {
+    "open": 2,
+    "openat": 4,
+    "openat2": 4,
+    "stat": 2,
+    "lstat": 2,
+    "newfstatat": 4,
+    "statx": 4,
+    "access": 2,
+    "faccessat": 4,
+    "faccessat2": 4,
+    "readlink": 2,
+    "readlinkat": 4,
+    "statfs": 2,
+    "fstat": 0,
+    "fstatfs": 0,
+    "read": 0,
+    "pread64": 0,
+    "lseek": 0,
+    "close": 0,
+    "mmap": 0,
+    "mprotect": 0,
+    "munmap": 0,
+    "brk": 0,
+    "arch_prctl": 0,
+    "set_tid_address": 0,
+    "set_robust_list": 0,
+    "rseq": 0,
+    "prlimit64": 0,
+    "getrandom": 0,
+    "uname": 0,
+}
+
+# Container image access. Pages of the image file (e.g., the SIF) that are
+# added to the page cache are reads from storage, whether they come from the
+# loop device, squashfuse, or the process itself, so we don't filter by
+# process here. We keep the first time we saw each page, which gives us the
+# order the container needs them in. The images table is filled from userspace.
+image_text = """
+struct image_t {
+    u64 ino;
+    u32 dev;
+};
+
+struct image_page_t {
+    u32 id;
+    u64 index;
+};
+
+struct image_access_t {
+    u64 ts;
+    u32 tgid;
+};
+
+BPF_HASH(images, struct image_t, u32);
+BPF_HASH(image_pages, struct image_page_t, struct image_access_t, 1048576);
+
+TRACEPOINT_PROBE(filemap, mm_filemap_add_to_page_cache) {
+    struct image_t image = {};
+    image.ino = args->i_ino;
+    image.dev = args->s_dev;
+    u32 *id = images.lookup(&image);
+    if (id == 0) {
+        return 0;
+    }
+    struct image_page_t key = {};
+    key.id = *id;
+    key.index = args->index;
+
+    struct image_access_t access = {};
+    access.ts = bpf_ktime_get_ns();
+    access.tgid = bpf_get_current_pid_tgid() >> 32;
+
+    // Only keep the first access
+    image_pages.insert(&key, &access);
+    return 0;
+}
+"""
+
+# VFS latency by filesystem. We tag each vfs_read, vfs_write and vfs_open with
+# the magic number of the superblock of the file, so we can tell squashfs and
+# overlayfs (containers) from ext4 or nfs (bare metal, shared storage).
+# Histograms are log2 usecs per filesystem and operation.
+vfs_text = """
+#include <linux/fs.h>
+#include <linux/path.h>
+#include <linux/dcache.h>
+
+#define VFS_READ 0
+#define VFS_WRITE 1
+#define VFS_OPEN 2
+
+struct vfs_start_key_t {
+    u32 pid;
+    u32 op;
+};
+
+struct vfs_start_t {
+    u64 ts;
+    u64 magic;
+};
+
+struct vfs_key_t {
+    u64 magic;
+    u32 op;
+};
+
+struct vfs_hist_key_t {
+    u64 magic;
+    u32 op;
+    u64 slot;
+};
+
+BPF_HASH(vfs_start, struct vfs_start_key_t, struct vfs_start_t);
+BPF_HASH(vfs_stats, struct vfs_key_t, struct stats_t);
+BPF_HISTOGRAM(vfs_hist, struct vfs_hist_key_t);
+
+static int vfs_enter(u32 op, u64 magic) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 tgid = pid_tgid >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct vfs_start_key_t key = {};
+    key.pid = pid_tgid;
+    key.op = op;
+    struct vfs_start_t start = {};
+    start.ts = bpf_ktime_get_ns();
+    start.magic = magic;
+    vfs_start.update(&key, &start);
+    return 0;
+}
+
+static int vfs_exit(u32 op) {
+    struct vfs_start_key_t start_key = {};
+    start_key.pid = bpf_get_current_pid_tgid();
+    start_key.op = op;
+    struct vfs_start_t *start = vfs_start.lookup(&start_key);
+    if (start == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - start->ts;
+
+    struct vfs_hist_key_t hkey = {};
+    hkey.magic = start->magic;
+    hkey.op = op;
+    hkey.slot = bpf_log2l(delta / 1000);
+    vfs_hist.increment(hkey);
+
+    struct vfs_key_t key = {};
+    key.magic = start->magic;
+    key.op = op;
+    vfs_start.delete(&start_key);
+
+    struct stats_t *stat = vfs_stats.lookup(&key);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+    } else {
+        struct stats_t s = {};
+        s.time = delta;
+        s.freq = 1;
+        vfs_stats.update(&key, &s);
+    }
+    return 0;
+}
+
+int vfs_read_entry(struct pt_regs *ctx, struct file *file) {
+    return vfs_enter(VFS_READ, file->f_inode->i_sb->s_magic);
+}
+
+int vfs_read_return(struct pt_regs *ctx) {
+    return vfs_exit(VFS_READ);
+}
+
+int vfs_write_entry(struct pt_regs *ctx, struct file *file) {
+    return vfs_enter(VFS_WRITE, file->f_inode->i_sb->s_magic);
+}
+
+int vfs_write_return(struct pt_regs *ctx) {
+    return vfs_exit(VFS_WRITE);
+}
+
+int vfs_open_entry(struct pt_regs *ctx, const struct path *path) {
+    return vfs_enter(VFS_OPEN, path->dentry->d_sb->s_magic);
+}
+
+int vfs_open_return(struct pt_regs *ctx) {
+    return vfs_exit(VFS_OPEN);
+}
+"""
+
+# Superblock magic numbers (see linux/magic.h) for filesystems we expect to see
+filesystems = {
+    0x73717368: "squashfs",
+    0x794C7630: "overlayfs",
+    0xEF53: "ext4",
+    0x58465342: "xfs",
+    0x9123683E: "btrfs",
+    0x6969: "nfs",
+    0x65735546: "fuse",
+    0x0BD00BD0: "lustre",
+    0x47504653: "gpfs",
+    0x01021994: "tmpfs",
+    0x9FA0: "proc",
+    0x62656572: "sysfs",
+    0x63677270: "cgroup2",
+    0x1CD1: "devpts",
+    0x50495045: "pipefs",
+    0x534F434B: "sockfs",
+    0x09041934: "anon_inode",
+}
+
+vfs_operations = ["read", "write", "open"]
+
+# Isolation layer costs. Each mechanism (seccomp, AppArmor, user namespaces,
+# memcg) is a small set of kernel functions, and we only time the outermost
+# call for a mechanism on a thread (the depth counts nested calls, e.g., aa_*
+# under an apparmor_* hook) so the time is not counted twice. We also count
+# syscalls so we can report the cost per syscall.
+isolation_text = isolation_structs + """
+struct iso_start_key_t {
+    u32 pid;
+    u32 mechanism;
+};
+
+struct iso_start_t {
+    u64 ts;
+    u64 ip;
+    u32 depth;
+};
+
+BPF_HASH(iso_start, struct iso_start_key_t, struct iso_start_t);
+BPF_HASH(iso_stats, struct iso_key_t, struct stats_t);
+BPF_PERCPU_HASH(iso_syscalls, u32, u64);
+
+static int iso_enter(struct pt_regs *ctx, u32 mechanism) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 tgid = pid_tgid >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct iso_start_key_t key = {};
+    key.pid = pid_tgid;
+    key.mechanism = mechanism;
+    struct iso_start_t *start = iso_start.lookup(&key);
+    if (start) {
+        start->depth++;
+        return 0;
+    }
+    struct iso_start_t s = {};
+    s.ts = bpf_ktime_get_ns();
+    s.ip = PT_REGS_IP(ctx);
+    s.depth = 1;
+    iso_start.update(&key, &s);
+    return 0;
+}
+
+static int iso_exit(struct pt_regs *ctx, u32 mechanism) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    struct iso_start_key_t start_key = {};
+    start_key.pid = pid_tgid;
+    start_key.mechanism = mechanism;
+    struct iso_start_t *start = iso_start.lookup(&start_key);
+    if (start == 0) {
+        return 0;
+    }
+    if (start->depth > 1) {
+        start->depth--;
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - start->ts;
+
+    struct iso_key_t key = {};
+    key.tgid = pid_tgid >> 32;
+    key.mechanism = mechanism;
+    key.ip = start->ip;
+    iso_start.delete(&start_key);
+
+    struct stats_t *stat = iso_stats.lookup(&key);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+    } else {
+        struct stats_t s = {};
+        s.time = delta;
+        s.freq = 1;
+        iso_stats.update(&key, &s);
+    }
+    return 0;
+}
+
+static int iso_syscall(struct bpf_raw_tracepoint_args *ctx) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    u64 zero = 0;
+    u64 *count = iso_syscalls.lookup_or_try_init(&tgid, &zero);
+    if (count) {
+        (*count)++;
+    }
+    return 0;
+}
+"""
+
+iso_handler_template = """
+int iso_enter_%(id)s(struct pt_regs *ctx) { return iso_enter(ctx, %(id)s); }
+int iso_exit_%(id)s(struct pt_regs *ctx) { return iso_exit(ctx, %(id)s); }
+"""
+
+# Isolation mechanisms and the kernel functions (regular expressions) for each.
+# These are the hooks that showed up in two-sample-t-reject-null.csv
+# (map_id_up, apparmor_*, memcg charging) plus the seccomp filter.
+isolation_mechanisms = {
+    "seccomp": "^__seccomp_filter$",
+    "apparmor": "^(apparmor_.*|aa_file_perm|aa_sk_perm|aa_path_name|aa_dfa_match)$",
+    "userns": "^(map_id_up|map_id_down|map_id_range_down)$",
+    "memcg": "^(__mem_cgroup_charge|__mem_cgroup_uncharge.*|try_charge_memcg|obj_cgroup_charge|obj_cgroup_uncharge.*|mem_cgroup_charge_skmem|mem_cgroup_uncharge_skmem|__memcg_kmem_charge_page|__memcg_kmem_uncharge_page|memcg_account_kmem|uncharge_batch|uncharge_folio)$",
+}
+
+# Poll, select and epoll waits. For each wait we classify the file descriptors
+# being waited on (socket, pipe, eventfd, device, ...) into a bitmask, and
+# at exit we know if it was ready, timed out or was interrupted. For poll we
+# look at the first 16 fds and for select the first 64. For epoll the fds are
+# in the kernel, so we remember the types added with epoll_ctl for each epoll
+# fd (we don't remove them on EPOLL_CTL_DEL). The poll_syscalls array maps a
+# syscall number to the kind of wait and is filled from userspace.
+poll_text = """
+#include <linux/fs.h>
+#include <linux/fdtable.h>
+#include <linux/dcache.h>
+#include <linux/poll.h>
+#include <linux/errno.h>
+#include <uapi/linux/eventpoll.h>
+
+#define POLL_POLL 1
+#define POLL_SELECT 2
+#define POLL_EPOLL_WAIT 3
+#define POLL_EPOLL_CTL 4
+
+#define FD_SOCKET 1
+#define FD_PIPE 2
+#define FD_EVENTFD 4
+#define FD_DEVICE 8
+#define FD_FILE 16
+#define FD_TIMERFD 32
+#define FD_OTHER 64
+
+#define OUTCOME_READY 0
+#define OUTCOME_TIMEOUT 1
+#define OUTCOME_INTERRUPTED 2
+#define OUTCOME_ERROR 3
+
+struct poll_start_t {
+    u64 ts;
+    u32 nr;
+    u32 types;
+};
+
+struct poll_key_t {
+    u32 tgid;
+    u32 nr;
+    u32 types;
+    u32 outcome;
+};
+
+struct epoll_key_t {
+    u32 tgid;
+    u32 epfd;
+};
+
+BPF_ARRAY(poll_syscalls, u32, 1024);
+BPF_HASH(poll_start, u32, struct poll_start_t);
+BPF_HASH(poll_stats, struct poll_key_t, struct stats_t);
+BPF_HASH(epoll_types, struct epoll_key_t, u32);
+
+static u32 fd_type(int fd) {
+    struct task_struct *task = (struct task_struct *)bpf_get_current_task();
+    struct fdtable *fdt = task->files->fdt;
+    if (fd < 0 || fd >= fdt->max_fds) {
+        return 0;
+    }
+    struct file **fds = fdt->fd;
+    struct file *file = 0;
+    bpf_probe_read_kernel(&file, sizeof(file), &fds[fd]);
+    if (file == 0) {
+        return 0;
+    }
+    umode_t mode = file->f_inode->i_mode;
+    if (S_ISSOCK(mode)) {
+        return FD_SOCKET;
+    }
+    if (S_ISFIFO(mode)) {
+        return FD_PIPE;
+    }
+    if (S_ISCHR(mode)) {
+        return FD_DEVICE;
+    }
+    if (S_ISREG(mode)) {
+        return FD_FILE;
+    }
+
+    // Anonymous inodes are named like [eventfd] or [timerfd]
+    char name[8] = {};
+    bpf_probe_read_kernel_str(&name, sizeof(name), file->f_path.dentry->d_name.name);
+    if (name[1] == 'e' && name[2] == 'v') {
+        return FD_EVENTFD;
+    }
+    if (name[1] == 't' && name[2] == 'i') {
+        return FD_TIMERFD;
+    }
+    return FD_OTHER;
+}
+
+static int poll_enter(struct bpf_raw_tracepoint_args *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    u32 tgid = pid_tgid >> 32;
+
+    u32 nr = ctx->args[1];
+    u32 *kind = poll_syscalls.lookup(&nr);
+    if (kind == 0 || *kind == 0) {
+        return 0;
+    }
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+
+    struct pt_regs *regs = (struct pt_regs *)ctx->args[0];
+    u64 arg1 = 0, arg2 = 0, arg3 = 0, arg4 = 0;
+    bpf_probe_read_kernel(&arg1, sizeof(arg1), &PT_REGS_PARM1(regs));
+    bpf_probe_read_kernel(&arg2, sizeof(arg2), &PT_REGS_PARM2(regs));
+
+    struct poll_start_t start = {};
+    start.nr = nr;
+
+    if (*kind == POLL_EPOLL_CTL) {
+        // epoll_ctl(epfd, op, fd, event), we only care about adds
+        bpf_probe_read_kernel(&arg3, sizeof(arg3), &PT_REGS_PARM3(regs));
+        if (arg2 != EPOLL_CTL_ADD) {
+            return 0;
+        }
+        struct epoll_key_t key = {};
+        key.tgid = tgid;
+        key.epfd = arg1;
+        u32 zero = 0;
+        u32 *types = epoll_types.lookup_or_try_init(&key, &zero);
+        if (types) {
+            *types |= fd_type(arg3);
+        }
+        return 0;
+    }
+
+    if (*kind == POLL_POLL) {
+        // poll(ufds, nfds, timeout)
+        struct pollfd pfd = {};
+        #pragma unroll
+        for (int i = 0; i < 16; i++) {
+            if (i >= arg2) {
+                break;
+            }
+            bpf_probe_read_user(&pfd, sizeof(pfd), (void *)arg1 + i * sizeof(pfd));
+            start.types |= fd_type(pfd.fd);
+        }
+    } else if (*kind == POLL_SELECT) {
+        // select(n, inp, outp, exp, tvp), the first word of in and out
+        u64 in = 0, out = 0;
+        bpf_probe_read_kernel(&arg3, sizeof(arg3), &PT_REGS_PARM3(regs));
+        if (arg2) {
+            bpf_probe_read_user(&in, sizeof(in), (void *)arg2);
+        }
+        if (arg3) {
+            bpf_probe_read_user(&out, sizeof(out), (void *)arg3);
+        }
+        u64 set = in | out;
+        #pragma unroll
+        for (int i = 0; i < 64; i++) {
+            if (i >= arg1) {
+                break;
+            }
+            if (set & (1ULL << i)) {
+                start.types |= fd_type(i);
+            }
+        }
+    } else if (*kind == POLL_EPOLL_WAIT) {
+        // epoll_wait(epfd, events, maxevents, timeout)
+        struct epoll_key_t key = {};
+        key.tgid = tgid;
+        key.epfd = arg1;
+        u32 *types = epoll_types.lookup(&key);
+        if (types) {
+            start.types = *types;
+        }
+    }
+
+    start.ts = bpf_ktime_get_ns();
+    poll_start.update(&pid, &start);
+    return 0;
+}
+
+static int poll_exit(struct bpf_raw_tracepoint_args *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    struct poll_start_t *start = poll_start.lookup(&pid);
+    if (start == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - start->ts;
+    long ret = ctx->args[1];
+
+    struct poll_key_t key = {};
+    key.tgid = pid_tgid >> 32;
+    key.nr = start->nr;
+    key.types = start->types;
+    if (ret > 0) {
+        key.outcome = OUTCOME_READY;
+    } else if (ret == 0) {
+        key.outcome = OUTCOME_TIMEOUT;
+    } else if (ret == -EINTR) {
+        key.outcome = OUTCOME_INTERRUPTED;
+    } else {
+        key.outcome = OUTCOME_ERROR;
+    }
+    poll_start.delete(&pid);
+
+    struct stats_t *stat = poll_stats.lookup(&key);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+    } else {
+        struct stats_t s = {};
+        s.time = delta;
+        s.freq = 1;
+        poll_stats.update(&key, &s);
+    }
+    return 0;
+}
+"""
+
+# Syscalls that wait on file descriptors, and the kind of wait (see poll_text)
+poll_syscalls = {
+    "poll": 1,
+    "ppoll": 1,
+    "select": 2,
+    "pselect6": 2,
+    "epoll_wait": 3,
+    "epoll_pwait": 3,
+    "epoll_pwait2": 3,
+    "epoll_ctl": 4,
+}
+
+fd_types = ["socket", "pipe", "eventfd", "device", "file", "timerfd", "other"]
+poll_outcomes = ["ready", "timeout", "interrupted", "error"]
+
+# Memory: page faults and mapping syscalls. The page fault tracepoints don't
+# have an exit, so we time faults with handle_mm_fault, and classify each by
+# its vma (file-backed or anonymous) or as huge if it goes through the huge
+# page paths. The mmap, munmap, brk (etc.) syscalls are timed with the raw
+# syscall tracepoints, and the mem_syscalls array is filled from userspace.
+memory_text = """
+#include <linux/mm.h>
+#include <linux/mm_types.h>
+
+#define FAULT_ANON 0
+#define FAULT_FILE 1
+#define FAULT_HUGE 2
+
+// Bits in mem_syscalls, these match MEM_TIME and MEM_LEN_ARG2 in Python
+#define MEM_TIME 1
+#define MEM_LEN_ARG2 2
+
+struct fault_start_t {
+    u64 ts;
+    u32 type;
+};
+
+struct fault_key_t {
+    u32 tgid;
+    u32 type;
+};
+
+struct fault_stats_t {
+    u64 time;
+    u64 freq;
+    u64 major;
+};
+
+struct fault_hist_key_t {
+    u32 type;
+    u64 slot;
+};
+
+struct mem_start_t {
+    u64 ts;
+    u64 len;
+    u32 nr;
+};
+
+struct mem_key_t {
+    u32 tgid;
+    u32 nr;
+};
+
+struct mem_stats_t {
+    u64 time;
+    u64 freq;
+    u64 bytes;
+};
+
+BPF_HASH(fault_start, u32, struct fault_start_t);
+BPF_HASH(fault_stats, struct fault_key_t, struct fault_stats_t);
+BPF_HISTOGRAM(fault_hist, struct fault_hist_key_t);
+BPF_ARRAY(mem_syscalls, u32, 1024);
+BPF_HASH(mem_start, u32, struct mem_start_t);
+BPF_HASH(mem_stats, struct mem_key_t, struct mem_stats_t);
+
+int fault_entry(struct pt_regs *ctx, struct vm_area_struct *vma) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    u32 tgid = pid_tgid >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct fault_start_t start = {};
+    start.ts = bpf_ktime_get_ns();
+    if (vma->vm_flags & VM_HUGETLB) {
+        start.type = FAULT_HUGE;
+    } else if (vma->vm_file) {
+        start.type = FAULT_FILE;
+    } else {
+        start.type = FAULT_ANON;
+    }
+    fault_start.update(&pid, &start);
+    return 0;
+}
+
+// A transparent huge page fault for a fault we are timing
+int fault_huge(struct pt_regs *ctx) {
+    u32 pid = bpf_get_current_pid_tgid();
+    struct fault_start_t *start = fault_start.lookup(&pid);
+    if (start) {
+        start->type = FAULT_HUGE;
+    }
+    return 0;
+}
+
+int fault_return(struct pt_regs *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    struct fault_start_t *start = fault_start.lookup(&pid);
+    if (start == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - start->ts;
+    u32 ret = PT_REGS_RC(ctx);
+
+    struct fault_key_t key = {};
+    key.tgid = pid_tgid >> 32;
+    key.type = start->type;
+    fault_start.delete(&pid);
+
+    struct fault_hist_key_t hkey = {};
+    hkey.type = key.type;
+    hkey.slot = bpf_log2l(delta / 1000);
+    fault_hist.increment(hkey);
+
+    struct fault_stats_t zero = {};
+    struct fault_stats_t *stat = fault_stats.lookup_or_try_init(&key, &zero);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+        if (ret & VM_FAULT_MAJOR) {
+            stat->major++;
+        }
+    }
+    return 0;
+}
+
+static int mem_enter(struct bpf_raw_tracepoint_args *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    u32 tgid = pid_tgid >> 32;
+
+    u32 nr = ctx->args[1];
+    u32 *flags = mem_syscalls.lookup(&nr);
+    if (flags == 0 || (*flags & MEM_TIME) == 0) {
+        return 0;
+    }
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+
+    // The length is the second argument for mmap, munmap, mremap (etc.)
+    struct pt_regs *regs = (struct pt_regs *)ctx->args[0];
+    struct mem_start_t start = {};
+    start.ts = bpf_ktime_get_ns();
+    start.nr = nr;
+    if (*flags & MEM_LEN_ARG2) {
+        bpf_probe_read_kernel(&start.len, sizeof(start.len), &PT_REGS_PARM2(regs));
+    }
+    mem_start.update(&pid, &start);
+    return 0;
+}
+
+static int mem_exit(struct bpf_raw_tracepoint_args *ctx) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 pid = pid_tgid;
+    struct mem_start_t *start = mem_start.lookup(&pid);
+    if (start == 0) {
+        return 0;
+    }
+    struct mem_key_t key = {};
+    key.tgid = pid_tgid >> 32;
+    key.nr = start->nr;
+
+    struct mem_stats_t zero = {};
+    struct mem_stats_t *stat = mem_stats.lookup_or_try_init(&key, &zero);
+    if (stat) {
+        stat->time += bpf_ktime_get_ns() - start->ts;
+        stat->freq++;
+        stat->bytes += start->len;
+    }
+    mem_start.delete(&pid);
+    return 0;
+}
+"""
+
+# Memory syscalls to time. The value is a bitmask (same as in memory_text),
+# to time the call, and to count the length in the second argument as bytes.
+MEM_TIME = 1
+MEM_LEN_ARG2 = 2
+
+mem_syscalls = {
+    "mmap": MEM_TIME | MEM_LEN_ARG2,
+    "munmap": MEM_TIME | MEM_LEN_ARG2,
+    "mremap": MEM_TIME | MEM_LEN_ARG2,
+    "brk": MEM_TIME,
+    "mprotect": MEM_TIME | MEM_LEN_ARG2,
+    "madvise": MEM_TIME | MEM_LEN_ARG2,
+}
+
+fault_types = ["anon", "file", "huge"]
+
+# Functions for transparent huge page faults (hugetlb is in the vma flags)
+fault_huge_functions = ["do_huge_pmd_anonymous_page", "do_huge_pmd_wp_page"]
+
+# Kernel lock contention with the contention_begin and contention_end
+# tracepoints (5.19+). Wait time is keyed by the lock address and the kernel
+# stack, so we can find the caller that took the lock, and the histograms are
+# per kind of lock (spinlock, mutex, rwsem, ...). Start times are keyed by
+# thread and lock since a mutex can spin on another lock while it waits.
+contention_text = """
+struct lock_start_key_t {
+    u32 pid;
+    u64 lock;
+};
+
+struct lock_start_t {
+    u64 ts;
+    int stack_id;
+    u32 flags;
+};
+
+struct lock_key_t {
+    u64 lock;
+    int stack_id;
+    u32 flags;
+};
+
+struct lock_stats_t {
+    u64 time;
+    u64 freq;
+    u64 max;
+};
+
+struct lock_hist_key_t {
+    u32 flags;
+    u64 slot;
+};
+
+BPF_HASH(lock_start, struct lock_start_key_t, struct lock_start_t);
+BPF_HASH(lock_stats, struct lock_key_t, struct lock_stats_t);
+BPF_HISTOGRAM(lock_hist, struct lock_hist_key_t);
+BPF_STACK_TRACE(lock_stacks, 16384);
+
+TRACEPOINT_PROBE(lock, contention_begin) {
+    u64 pid_tgid = bpf_get_current_pid_tgid();
+    u32 tgid = pid_tgid >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct lock_start_key_t key = {};
+    key.pid = pid_tgid;
+    key.lock = (u64)args->lock_addr;
+
+    struct lock_start_t start = {};
+    start.ts = bpf_ktime_get_ns();
+    start.stack_id = lock_stacks.get_stackid(args, 0);
+    start.flags = args->flags;
+    lock_start.update(&key, &start);
+    return 0;
+}
+
+TRACEPOINT_PROBE(lock, contention_end) {
+    struct lock_start_key_t start_key = {};
+    start_key.pid = bpf_get_current_pid_tgid();
+    start_key.lock = (u64)args->lock_addr;
+    struct lock_start_t *start = lock_start.lookup(&start_key);
+    if (start == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - start->ts;
+
+    struct lock_key_t key = {};
+    key.lock = start_key.lock;
+    key.stack_id = start->stack_id;
+    key.flags = start->flags;
+
+    struct lock_hist_key_t hkey = {};
+    hkey.flags = start->flags;
+    hkey.slot = bpf_log2l(delta / 1000);
+    lock_hist.increment(hkey);
+    lock_start.delete(&start_key);
+
+    struct lock_stats_t zero = {};
+    struct lock_stats_t *stat = lock_stats.lookup_or_try_init(&key, &zero);
+    if (stat) {
+        stat->time += delta;
+        stat->freq++;
+        if (delta > stat->max) {
+            stat->max = delta;
+        }
+    }
+    return 0;
+}
+"""
+
+# Lock kinds from the contention tracepoint flags (LCB_F_* in the kernel)
+lock_flags = {
+    1: "spinlock",
+    2: "read",
+    4: "write",
+    8: "rt",
+    16: "percpu",
+    32: "mutex",
+}
+
+# Frames that are part of taking the lock, we skip these to find the caller.
+# These are prefixes of the lock primitives, since a substring like "lock"
+# would skip real callers too (clock_*, *block*, flock_*).
+lock_frames = (
+    "_raw_spin_",
+    "_raw_read_",
+    "_raw_write_",
+    "do_raw_",
+    "raw_spin_rq_",
+    "queued_",
+    "native_queued_",
+    "__pv_queued_",
+    "mutex_",
+    "__mutex_",
+    "rt_mutex_",
+    "__rt_mutex_",
+    "rwsem_",
+    "__rwsem_",
+    "down_",
+    "__down",
+    "percpu_down_",
+    "percpu_rwsem_",
+    "osq_",
+    "__lock",
+    "lock_acquire",
+    "lock_contended",
+)
+
+# Interference: migrations, hard IRQ and softirq time, and timer ticks that hit
+# a tracked process, per (tgid, cpu). Interrupts are charged to the task that
+# was running when they came in. The address of tick_sched_timer is set from
+# userspace so we can tell scheduler ticks from other hrtimers.
+interference_text = """
+struct intf_key_t {
+    u32 tgid;
+    u32 cpu;
+};
+
+struct intf_t {
+    u64 migrations;
+    u64 irq_count;
+    u64 irq_nsecs;
+    u64 softirq_count;
+    u64 softirq_nsecs;
+    u64 ticks;
+};
+
+BPF_HASH(interference, struct intf_key_t, struct intf_t);
+BPF_PERCPU_ARRAY(irq_start, u64, 1);
+BPF_PERCPU_ARRAY(softirq_start, u64, 1);
+BPF_ARRAY(tick_function, u64, 1);
+
+static struct intf_t *get_interference(u32 tgid, u32 cpu) {
+    struct intf_key_t key = {};
+    key.tgid = tgid;
+    key.cpu = cpu;
+    struct intf_t zero = {};
+    return interference.lookup_or_try_init(&key, &zero);
+}
+
+int intf_migrate(struct bpf_raw_tracepoint_args *ctx) {
+    // args are the task and the destination cpu
+    struct task_struct *task = (struct task_struct *)ctx->args[0];
+    u32 tgid = 0;
+    bpf_probe_read_kernel(&tgid, sizeof(tgid), &task->tgid);
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct intf_t *intf = get_interference(tgid, ctx->args[1]);
+    if (intf) {
+        intf->migrations++;
+    }
+    return 0;
+}
+
+TRACEPOINT_PROBE(irq, irq_handler_entry) {
+    u32 zero = 0;
+    u64 ts = bpf_ktime_get_ns();
+    irq_start.update(&zero, &ts);
+    return 0;
+}
+
+TRACEPOINT_PROBE(irq, irq_handler_exit) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    u32 zero = 0;
+    u64 *tsp = irq_start.lookup(&zero);
+    if (tsp == 0 || *tsp == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - *tsp;
+    *tsp = 0;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct intf_t *intf = get_interference(tgid, bpf_get_smp_processor_id());
+    if (intf) {
+        intf->irq_count++;
+        intf->irq_nsecs += delta;
+    }
+    return 0;
+}
+
+TRACEPOINT_PROBE(irq, softirq_entry) {
+    u32 zero = 0;
+    u64 ts = bpf_ktime_get_ns();
+    softirq_start.update(&zero, &ts);
+    return 0;
+}
+
+TRACEPOINT_PROBE(irq, softirq_exit) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    u32 zero = 0;
+    u64 *tsp = softirq_start.lookup(&zero);
+    if (tsp == 0 || *tsp == 0) {
+        return 0;
+    }
+    u64 delta = bpf_ktime_get_ns() - *tsp;
+    *tsp = 0;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    struct intf_t *intf = get_interference(tgid, bpf_get_smp_processor_id());
+    if (intf) {
+        intf->softirq_count++;
+        intf->softirq_nsecs += delta;
+    }
+    return 0;
+}
+
+TRACEPOINT_PROBE(timer, hrtimer_expire_entry) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    if (tracked.lookup(&tgid) == 0) {
+        return 0;
+    }
+    u32 zero = 0;
+    u64 *tick = tick_function.lookup(&zero);
+    if (tick == 0 || *tick != (u64)args->function) {
+        return 0;
+    }
+    struct intf_t *intf = get_interference(tgid, bpf_get_smp_processor_id());
+    if (intf) {
+        intf->ticks++;
+    }
+    return 0;
+}
+"""
+
+# A raw tracepoint can only be attached once, so the modes that use the
+# syscall tracepoints share one handler for each, and it calls the modes
+# that are enabled (they are defined from syscall_modes when we compile).
+syscall_dispatch_text = """
+RAW_TRACEPOINT_PROBE(sys_enter) {
+#ifdef SYSCALLS_MODE
+    syscalls_enter(ctx);
+#endif
+#ifdef STARTUP_MODE
+    startup_enter(ctx);
+#endif
+#ifdef ISOLATION_MODE
+    iso_syscall(ctx);
+#endif
+#ifdef POLL_MODE
+    poll_enter(ctx);
+#endif
+#ifdef MEMORY_MODE
+    mem_enter(ctx);
+#endif
+    return 0;
+}
+
+RAW_TRACEPOINT_PROBE(sys_exit) {
+#ifdef SYSCALLS_MODE
+    syscalls_exit(ctx);
+#endif
+#ifdef STARTUP_MODE
+    startup_exit(ctx);
+#endif
+#ifdef POLL_MODE
+    poll_exit(ctx);
+#endif
+#ifdef MEMORY_MODE
+    mem_exit(ctx);
+#endif
+    return 0;
+}
+"""
+
+# Modes (args) that use the syscall tracepoints, and their define
+syscall_modes = {
+    "syscalls": "SYSCALLS_MODE",
+    "startup": "STARTUP_MODE",
+    "isolation": "ISOLATION_MODE",
+    "poll": "POLL_MODE",
+    "memory": "MEMORY_MODE",
+}
+
+interference_fields = [
+    "migrations",
+    "irq_count",
+    "irq_nsecs",
+    "softirq_count",
+    "softirq_nsecs",
+    "ticks",
+]
+
+
+def get_matches(pattern):
+    program = BPF(text=bpf_text)
+    program.attach_kprobe(event_re=pattern, fn_name="start_timing")
+    program.attach_kretprobe(event_re=pattern, fn_name="stop_timing")
+
+    # This tells us the number of kprobes we match
+    matched = program.num_open_kprobes()
+    print(matched)
+
+
+def get_children(pid):
+    """
+    Recursively get the pids of all children of a pid.
+    """
+    children = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except FileNotFoundError:
+        return children
+    for task in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as fd:
+                pids = [int(x) for x in fd.read().split()]
+        except FileNotFoundError:
+            continue
+        for child in pids:
+            children.append(child)
+            children += get_children(child)
+    return children
+
+
+def add_filter(program, pid):
+    """
+    Add a filter to a tgid (thread group id) based on
+    a program pid. A group of pids can belong to a tgid,
+    and usually the first is the tgid. We also follow children,
+    since with mpirun the ranks are forked from the pid we launch.
+    Children that exist before the program is loaded are added here,
+    and the rest are added by the fork tracepoint.
+    """
+    tracked = program.get_table("tracked")
+    for tgid in [pid] + get_children(pid):
+        tracked[tracked.Key(tgid)] = tracked.Leaf(1)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Time functions and print time spent in each function",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--pid", type=int, help="trace a single PID only")
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        help="search expression for functions (defaults to do_sys* without --syscalls)",
+    )
+    parser.add_argument(
+        "--syscalls",
+        help="time all syscalls with raw tracepoints (cheaper than do_sys* kprobes)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--sched",
+        help="account off-CPU time (blocked, preempted) and run queue latency per rank",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--mpi",
+        help="time MPI functions with uprobes on the MPI library of each rank",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--mpi-functions",
+        dest="mpi_functions",
+        help="comma separated MPI functions to time (defaults to a common set)",
+    )
+    parser.add_argument(
+        "--startup",
+        help="trace the dynamic linker from exec to the first application syscall",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--image",
+        help="record pages read from this container image (can be used more than once)",
+        action="append",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="write an ordered prefetch manifest for --image to this file",
+    )
+    parser.add_argument(
+        "--vfs",
+        help="time vfs_read, vfs_write and vfs_open per filesystem type",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--isolation",
+        help="time isolation hooks (seccomp, apparmor, user namespaces, memcg) per syscall",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--poll",
+        help="time poll, select and epoll waits per rank by fd type and outcome",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--memory",
+        help="time page faults (anon, file, huge) and mmap/munmap/brk per rank",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--contention",
+        help="profile kernel lock contention by lock address and caller",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--interference",
+        help="count migrations, IRQ and softirq time, and timer ticks per CPU and rank",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--pin",
+        help=f"pin maps and programs under {pin_root}/<name> to read them with read-pinned.py",
+    )
+    parser.add_argument(
+        "--log-dir",
+        dest="log_dir",
+        help="also write application stdout and stderr to rotating logs in this directory",
+    )
+    parser.add_argument(
+        "--log-max-bytes",
+        dest="log_max_bytes",
+        help="rotate application logs at this size (defaults to 64MB)",
+        type=int,
+        default=64 * 1024 * 1024,
+    )
+    parser.add_argument(
+        "--log-backups",
+        dest="log_backups",
+        help="number of rotated application logs to keep (defaults to 4)",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--quiet",
+        help="do not echo application output to the terminal (use with --log-dir)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--timeout",
+        help="stop the application after this many seconds and write what we have",
+        type=float,
+    )
+    parser.add_argument(
+        "--grace",
+        help="seconds to wait after SIGTERM before we SIGKILL the application",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--interval",
+        help="seconds between polls of the perf buffers (defaults to 0.1)",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="write function totals to this file (json) while the run is going",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        dest="snapshot_interval",
+        help="seconds between --snapshot writes (defaults to 30)",
+        type=float,
+        default=30,
+    )
+    return parser
+
+
+def print_block(name, data):
+    """
+    Print a json block of results between markers we can parse later.
+    """
+    print(f"\n=== {name} START")
+    print(json.dumps(data))
+    print(f"=== {name} END")
+
+
+def collect_syscalls(program):
+    """
+    Sum the per-CPU syscall stats into one row per syscall.
+
+    These are named like syscall:openat so they don't collide with
+    kernel functions in the same results table.
+    """
+    from bcc.syscall import syscall_name
+
+    results = []
+    for k, v in program.get_table("syscalls").items():
+        count = sum(cpu.freq for cpu in v)
+        if count == 0:
+            continue
+        name = syscall_name(k.value).decode("utf-8")
+        results.append(
+            {
+                "func": f"syscall:{name}",
+                "syscall": k.value,
+                "count": count,
+                "time_nsecs": sum(cpu.time for cpu in v),
+                "cpus": len([cpu for cpu in v if cpu.freq]),
+            }
+        )
+    return results
+
+
+def get_pid(program):
+    """
+    Get the pid(s) of a program by name.
+
+    We could use psutil for this, but I would
+    rather not install an extra thing.
+    """
+    pid = subprocess.check_output(["pidof", program])
+    if not pid:
+        raise ValueError(f"Cannot get pid for {program}")
+    pid = pid.decode("utf-8").strip().split(" ")
+    return [int(x) for x in pid]
+
+
+def pid_exists(pid):
+    """
+    Check if a pid exists in the current process table.
+
+    This is exactly how psutil words, minus the edge cases.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # (EINVAL, EPERM, ESRCH)
+    else:
+        return True
+
+
+def get_mpi_text(functions):
+    """
+    Generate the MPI program with an entry and exit handler per function.
+    """
+    text = mpi_text
+    for i, _ in enumerate(functions):
+        text += mpi_handler_template % {"id": i}
+    return text
+
+
+def find_mpi_libraries(pid):
+    """
+    Find MPI libraries mapped by a process.
+
+    We return the path as the host sees it, through /proc/<pid>/root, so this
+    works for a library inside a container (e.g., a SIF) as well.
+    """
+    libraries = set()
+    try:
+        with open(f"/proc/{pid}/maps") as fd:
+            lines = fd.readlines()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return libraries
+    for line in lines:
+        parts = line.split(None, 5)
+        if len(parts) < 6:
+            continue
+        path = parts[5].strip()
+        if any(name in os.path.basename(path) for name in mpi_libraries):
+            libraries.add(path)
+    return [(path, f"/proc/{pid}/root{path}") for path in libraries]
+
+
+def attach_mpi(program, functions, pids, attached):
+    """
+    Attach MPI uprobes for any new libraries mapped by pids.
+
+    Uprobes are per file, so we only attach once for each library (by
+    device and inode) even if it is used by all ranks. Attached is a dict
+    of (dev, inode) to the library details, and we return the pids that
+    have their libraries attached.
+    """
+    done = set()
+    for pid in pids:
+        libraries = find_mpi_libraries(pid)
+        for path, host_path in libraries:
+            try:
+                st = os.stat(host_path)
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in attached:
+                if pid not in attached[key]["pids"]:
+                    attached[key]["pids"].append(pid)
+                continue
+            attached[key] = {"path": path, "pids": [pid], "functions": []}
+            for i, func in enumerate(functions):
+                try:
+                    program.attach_uprobe(
+                        name=host_path, sym=func, fn_name=f"mpi_enter_{i}"
+                    )
+                except Exception:
+                    # This library doesn't have the function, it's probably in another
+                    continue
+
+                # An entry without an exit would leave calls in the start table
+                try:
+                    program.attach_uretprobe(
+                        name=host_path, sym=func, fn_name=f"mpi_exit_{i}"
+                    )
+                except Exception:
+                    program.detach_uprobe(name=host_path, sym=func)
+                    continue
+                attached[key]["functions"].append(func)
+            print(f"Timing {len(attached[key]['functions'])} MPI functions in {path}")
+        if libraries:
+            done.add(pid)
+    return done
+
+
+def setup_startup(program):
+    """
+    Fill the startup syscalls table and attach the startup tracing.
+    """
+    from bcc.syscall import syscalls
+
+    table = program.get_table("startup_syscalls")
+    numbers = {name.decode("utf-8"): nr for nr, name in syscalls.items()}
+    for name, path_arg in startup_syscalls.items():
+        if name in numbers:
+            table[table.Key(numbers[name])] = table.Leaf(1 | path_arg)
+
+    # The syscalls go through the shared handlers (see syscall_dispatch_text)
+    program.attach_raw_tracepoint(tp="sched_process_exec", fn_name="startup_exec")
+
+
+def is_library(path):
+    """
+    Determine if a path is a shared library (libfoo.so or libfoo.so.1.2)
+    """
+    name = os.path.basename(path)
+    return name.endswith(".so") or ".so." in name
+
+
+def summarize_startup(events, ranks):
+    """
+    Attribute startup time for each process.
+
+    Failed lookups (ENOENT) are attributed to the library by name, since
+    the loader tries each directory on the search path for it. Syscalls
+    after a library is opened (mmap, read, fstat, close) count as loading
+    it. Time in user space while the loader is running is mostly relocation,
+    and time between windows (after an END and before the next exec) is the
+    runtime (e.g., singularity) doing its own work.
+    """
+    from bcc.syscall import syscall_name
+
+    processes = {}
+    libraries = {}
+    by_process = {}
+    for event in events:
+        by_process.setdefault(event["tgid"], []).append(event)
+
+    def get_library(name):
+        if name not in libraries:
+            libraries[name] = {
+                "library": name,
+                "ranks": set(),
+                "paths": set(),
+                "lookup_count": 0,
+                "lookup_nsecs": 0,
+                "load_nsecs": 0,
+            }
+        return libraries[name]
+
+    for tgid, process_events in sorted(by_process.items()):
+        process = {
+            "tgid": tgid,
+            "rank": ranks.get(tgid),
+            "execs": 0,
+            "startup_nsecs": 0,
+            "lookup_count": 0,
+            "lookup_nsecs": 0,
+            "load_nsecs": 0,
+            "other_syscall_nsecs": 0,
+            "relocation_nsecs": 0,
+            "runtime_nsecs": 0,
+            "libraries": 0,
+            "first_syscall": None,
+        }
+        processes[tgid] = process
+
+        library = None
+        window_start = None
+        window_syscalls = 0
+        first_exec = None
+        last_end = None
+        # Events come from per-CPU buffers, so they need to be ordered
+        for event in sorted(process_events, key=lambda x: x["ts"]):
+            if event["type"] == 0:
+                process["execs"] += 1
+                if first_exec is None:
+                    first_exec = event["ts"]
+                if last_end is not None:
+                    process["runtime_nsecs"] += event["ts"] - last_end
+                window_start = event["ts"]
+                window_syscalls = 0
+                library = None
+
+            elif event["type"] == 1:
+                window_syscalls += event["delta"]
+                name = syscall_name(event["nr"]).decode("utf-8")
+                path = event["path"]
+
+                # A failed lookup, probably somewhere on the library path
+                if event["ret"] == -2:
+                    process["lookup_count"] += 1
+                    process["lookup_nsecs"] += event["delta"]
+                    key = os.path.basename(path) if is_library(path) else "(other)"
+                    entry = get_library(key)
+                    entry["ranks"].add(tgid)
+                    entry["lookup_count"] += 1
+                    entry["lookup_nsecs"] += event["delta"]
+                    continue
+
+                # A successful open of a library starts loading it
+                if name.startswith("open") and event["ret"] >= 0:
+                    library = os.path.basename(path) if is_library(path) else None
+                    if library:
+                        process["libraries"] += 1
+                        entry = get_library(library)
+                        entry["ranks"].add(tgid)
+                        entry["paths"].add(path)
+
+                if library:
+                    process["load_nsecs"] += event["delta"]
+                    get_library(library)["load_nsecs"] += event["delta"]
+                else:
+                    process["other_syscall_nsecs"] += event["delta"]
+
+            elif event["type"] == 2:
+                process["first_syscall"] = syscall_name(event["nr"]).decode("utf-8")
+                last_end = event["ts"]
+                if window_start is not None:
+                    window = event["ts"] - window_start
+                    process["relocation_nsecs"] += max(window - window_syscalls, 0)
+                window_start = None
+
+        if first_exec is not None and last_end is not None:
+            process["startup_nsecs"] = last_end - first_exec
+
+    # Per library cost table, sorted by total cost across ranks
+    table = []
+    for entry in libraries.values():
+        entry["ranks"] = len(entry["ranks"])
+        entry["paths"] = sorted(entry["paths"])
+        entry["total_nsecs"] = entry["lookup_nsecs"] + entry["load_nsecs"]
+        table.append(entry)
+    table.sort(key=lambda x: x["total_nsecs"], reverse=True)
+    return list(processes.values()), table
+
+
+def setup_images(program, paths):
+    """
+    Add the images to the filter by device and inode.
+
+    The tracepoint has the kernel dev_t, which encodes major and minor
+    differently than st_dev in userspace.
+    """
+    table = program.get_table("images")
+    for i, path in enumerate(paths):
+        st = os.stat(path)
+        key = table.Key()
+        key.ino = st.st_ino
+        key.dev = (os.major(st.st_dev) << 20) | os.minor(st.st_dev)
+        table[key] = table.Leaf(i)
+
+
+def collect_images(program, paths, ranks, gap=16):
+    """
+    Collect pages read from each image into ordered ranges.
+
+    Pages are sorted by first access, and a page that follows the current
+    range (within a gap of a few pages, since readahead and large folios
+    don't add every page) extends it. Offsets and lengths are in bytes.
+    """
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    pages = {}
+    for k, v in program.get_table("image_pages").items():
+        pages.setdefault(k.id, []).append((v.ts, k.index, v.tgid))
+
+    images = []
+    for i, path in enumerate(paths):
+        accesses = sorted(pages.get(i, []))
+        ranges = []
+        for ts, index, tgid in accesses:
+            if ranges:
+                start, end, _, _ = ranges[-1]
+                if start <= index and index <= end + gap:
+                    ranges[-1][1] = max(end, index)
+                    continue
+            ranges.append([index, index, ts, tgid])
+
+        start_ts = accesses[0][0] if accesses else 0
+        st = os.stat(path)
+        images.append(
+            {
+                "image": os.path.abspath(path),
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "page_size": page_size,
+                "pages": len(accesses),
+                "bytes": len(accesses) * page_size,
+                # offset, length, ms after the first read, and rank
+                "ranges": [
+                    [
+                        start * page_size,
+                        (end - start + 1) * page_size,
+                        (ts - start_ts) / 1e6,
+                        ranks.get(tgid),
+                    ]
+                    for start, end, ts, tgid in ranges
+                ],
+            }
+        )
+    return images
+
+
+def collect_vfs(program):
+    """
+    Collect VFS latency per filesystem and operation.
+
+    Histograms are [low, high, count] in usecs, and filesystems we don't
+    know are named by magic number.
+    """
+    rows = {}
+
+    def get_row(magic, op):
+        key = (magic, op)
+        if key not in rows:
+            rows[key] = {
+                "filesystem": filesystems.get(magic, hex(magic)),
+                "magic": magic,
+                "operation": vfs_operations[op],
+                "count": 0,
+                "time_nsecs": 0,
+                "hist_usecs": [],
+            }
+        return rows[key]
+
+    for k, v in program.get_table("vfs_stats").items():
+        row = get_row(k.magic, k.op)
+        row["count"] = v.freq
+        row["time_nsecs"] = v.time
+
+    for k, v in program.get_table("vfs_hist").items():
+        low = (1 << k.slot) if k.slot else 0
+        high = (1 << (k.slot + 1)) - 1
+        get_row(k.magic, k.op)["hist_usecs"].append([low, high, v.value])
+
+    for row in rows.values():
+        row["hist_usecs"].sort()
+    return sorted(rows.values(), key=lambda x: x["time_nsecs"], reverse=True)
+
+
+def get_isolation_text():
+    """
+    Generate the isolation program with an entry and exit handler per mechanism.
+    """
+    text = isolation_text
+    for i, _ in enumerate(isolation_mechanisms):
+        text += iso_handler_template % {"id": i}
+    return text
+
+
+def attach_isolation(program):
+    """
+    Attach the isolation hooks, and return the number of functions per mechanism.
+
+    A mechanism that is not in this kernel (e.g., no AppArmor) just has zero.
+    """
+    probed = {}
+    for i, (mechanism, pattern) in enumerate(isolation_mechanisms.items()):
+        before = program.num_open_kprobes()
+        try:
+            program.attach_kprobe(event_re=pattern, fn_name=f"iso_enter_{i}")
+            program.attach_kretprobe(event_re=pattern, fn_name=f"iso_exit_{i}")
+        except Exception:
+            pass
+        probed[mechanism] = int((program.num_open_kprobes() - before) / 2)
+        print(f"Timing {probed[mechanism]} {mechanism} functions")
+
+    # Syscalls are counted by the shared handler (see syscall_dispatch_text)
+    return probed
+
+
+def collect_isolation(program, probed):
+    """
+    Roll up isolation costs by mechanism, and normalize by syscalls.
+    """
+    mechanisms = list(isolation_mechanisms)
+    syscalls = 0
+    for k, v in program.get_table("iso_syscalls").items():
+        syscalls += sum(v)
+
+    rollup = {}
+    for mechanism in mechanisms:
+        rollup[mechanism] = {
+            "mechanism": mechanism,
+            "functions_probed": probed.get(mechanism, 0),
+            "count": 0,
+            "time_nsecs": 0,
+            "syscalls": syscalls,
+            "nsecs_per_syscall": 0,
+            "functions": {},
+        }
+
+    for k, v in program.get_table("iso_stats").items():
+        row = rollup[mechanisms[k.mechanism]]
+        func = BPF.sym(k.ip, -1).decode("utf-8")
+        row["count"] += v.freq
+        row["time_nsecs"] += v.time
+        row["functions"][func] = row["functions"].get(func, 0) + v.time
+
+    for row in rollup.values():
+        if syscalls:
+            row["nsecs_per_syscall"] = row["time_nsecs"] / syscalls
+        row["functions"] = dict(
+            sorted(row["functions"].items(), key=lambda x: x[1], reverse=True)
+        )
+    return list(rollup.values())
+
+
+def setup_poll(program):
+    """
+    Fill the poll syscalls table, the waits are timed by the shared
+    syscall handlers (see syscall_dispatch_text).
+    """
+    from bcc.syscall import syscalls
+
+    table = program.get_table("poll_syscalls")
+    numbers = {name.decode("utf-8"): nr for nr, name in syscalls.items()}
+    for name, kind in poll_syscalls.items():
+        if name in numbers:
+            table[table.Key(numbers[name])] = table.Leaf(kind)
+
+
+def get_fd_types(mask):
+    """
+    Get a name for a bitmask of fd types, e.g., socket+eventfd
+    """
+    names = [name for i, name in enumerate(fd_types) if mask & (1 << i)]
+    return "+".join(names) or "unknown"
+
+
+def collect_poll(program, ranks):
+    """
+    Collect poll waits, one row per rank, syscall, fd types and outcome.
+    """
+    from bcc.syscall import syscall_name
+
+    rows = []
+    for k, v in program.get_table("poll_stats").items():
+        rows.append(
+            {
+                "tgid": k.tgid,
+                "rank": ranks.get(k.tgid),
+                "syscall": syscall_name(k.nr).decode("utf-8"),
+                "fd_types": get_fd_types(k.types),
+                "outcome": poll_outcomes[k.outcome],
+                "count": v.freq,
+                "time_nsecs": v.time,
+            }
+        )
+    return sorted(rows, key=lambda x: x["time_nsecs"], reverse=True)
+
+
+def setup_memory(program):
+    """
+    Attach page fault timing, and fill the memory syscalls table (they are
+    timed by the shared syscall handlers, see syscall_dispatch_text).
+    """
+    from bcc.syscall import syscalls
+
+    program.attach_kprobe(event="handle_mm_fault", fn_name="fault_entry")
+    program.attach_kretprobe(event="handle_mm_fault", fn_name="fault_return")
+    for func in fault_huge_functions:
+        try:
+            program.attach_kprobe(event=func, fn_name="fault_huge")
+        except Exception:
+            print(f"Cannot attach to {func}, huge page faults may count as anon.")
+
+    table = program.get_table("mem_syscalls")
+    numbers = {name.decode("utf-8"): nr for nr, name in syscalls.items()}
+    for name, flags in mem_syscalls.items():
+        if name in numbers:
+            table[table.Key(numbers[name])] = table.Leaf(flags)
+
+
+def collect_memory(program, ranks):
+    """
+    Collect page faults and memory syscalls, one row per rank.
+
+    Fault latency histograms are per fault type (across ranks), in
+    [low, high, count] usecs buckets.
+    """
+    from bcc.syscall import syscall_name
+
+    processes = {}
+
+    def get_process(tgid):
+        if tgid not in processes:
+            processes[tgid] = {
+                "tgid": tgid,
+                "rank": ranks.get(tgid),
+                "faults": {},
+                "syscalls": {},
+            }
+        return processes[tgid]
+
+    for k, v in program.get_table("fault_stats").items():
+        get_process(k.tgid)["faults"][fault_types[k.type]] = {
+            "count": v.freq,
+            "major": v.major,
+            "time_nsecs": v.time,
+        }
+
+    for k, v in program.get_table("mem_stats").items():
+        name = syscall_name(k.nr).decode("utf-8")
+        get_process(k.tgid)["syscalls"][name] = {
+            "count": v.freq,
+            "time_nsecs": v.time,
+            "bytes": v.bytes,
+        }
+
+    hists = {name: [] for name in fault_types}
+    for k, v in program.get_table("fault_hist").items():
+        low = (1 << k.slot) if k.slot else 0
+        high = (1 << (k.slot + 1)) - 1
+        hists[fault_types[k.type]].append([low, high, v.value])
+    for hist in hists.values():
+        hist.sort()
+    return {"ranks": list(processes.values()), "fault_hist_usecs": hists}
+
+
+def get_lock_kind(flags):
+    """
+    Get a name for lock contention flags, e.g., spinlock or read+percpu
+    """
+    names = [name for bit, name in lock_flags.items() if flags & bit]
+    if not names:
+        return "semaphore"
+    if names == ["read"] or names == ["write"]:
+        names = ["rwsem"] + names
+    return "+".join(names)
+
+
+def get_lock_caller(program, stack_id):
+    """
+    Get the first function in the stack that is not part of taking the lock.
+    """
+    if stack_id < 0:
+        return "[unknown]"
+    for addr in program.get_table("lock_stacks").walk(stack_id):
+        func = BPF.ksym(addr).decode("utf-8")
+        if not func.startswith(lock_frames):
+            return func
+    return "[unknown]"
+
+
+def collect_contention(program):
+    """
+    Collect lock wait time by lock and caller.
+
+    Histograms are per kind of lock in [low, high, count] usecs buckets.
+    """
+    locks = {}
+    for k, v in program.get_table("lock_stats").items():
+        caller = get_lock_caller(program, k.stack_id)
+        key = (k.lock, caller, k.flags)
+        if key not in locks:
+            locks[key] = {
+                "lock": hex(k.lock),
+                "lock_symbol": BPF.ksym(k.lock).decode("utf-8"),
+                "caller": caller,
+                "kind": get_lock_kind(k.flags),
+                "count": 0,
+                "time_nsecs": 0,
+                "max_nsecs": 0,
+            }
+        locks[key]["count"] += v.freq
+        locks[key]["time_nsecs"] += v.time
+        locks[key]["max_nsecs"] = max(locks[key]["max_nsecs"], v.max)
+
+    hists = {}
+    for k, v in program.get_table("lock_hist").items():
+        low = (1 << k.slot) if k.slot else 0
+        high = (1 << (k.slot + 1)) - 1
+        hists.setdefault(get_lock_kind(k.flags), []).append([low, high, v.value])
+    for hist in hists.values():
+        hist.sort()
+
+    rows = sorted(locks.values(), key=lambda x: x["time_nsecs"], reverse=True)
+    return {"locks": rows, "hist_usecs": hists}
+
+
+def setup_interference(program):
+    """
+    Set the tick function address and attach the migration tracepoint.
+    """
+    table = program.get_table("tick_function")
+    table[table.Key(0)] = table.Leaf(BPF.ksymname("tick_sched_timer"))
+    program.attach_raw_tracepoint(tp="sched_migrate_task", fn_name="intf_migrate")
+
+
+def collect_interference(program, ranks):
+    """
+    Collect interference, summed per rank and per CPU.
+    """
+    processes = {}
+    cpus = {}
+    for k, v in program.get_table("interference").items():
+        process = processes.setdefault(
+            k.tgid,
+            {"tgid": k.tgid, "rank": ranks.get(k.tgid), "cpus": 0}
+            | {field: 0 for field in interference_fields},
+        )
+        cpu = cpus.setdefault(
+            k.cpu, {"cpu": k.cpu} | {field: 0 for field in interference_fields}
+        )
+        process["cpus"] += 1
+        for field in interference_fields:
+            process[field] += getattr(v, field)
+            cpu[field] += getattr(v, field)
+
+    return {
+        "ranks": sorted(processes.values(), key=lambda x: x["tgid"]),
+        "cpus": sorted(cpus.values(), key=lambda x: x["cpu"]),
+    }
+
+
+def pin_program(program, name):
+    """
+    Pin the result tables and programs to bpffs.
+
+    The maps keep the results if the collector dies, and can be read (or
+    reset) from another process. Programs are pinned so they stay loaded,
+    but the kprobes and tracepoints are detached when the collector exits.
+    """
+    from bcc import libbcc
+
+    # Old pins would be read as this run, so we never reuse a directory
+    path = os.path.join(pin_root, name)
+    try:
+        os.makedirs(path)
+    except FileExistsError:
+        sys.exit(f"{path} exists, remove it with read-pinned.py remove {name}")
+
+    pins = []
+    for table_name in pinned_tables:
+        try:
+            pins.append((table_name, program.get_table(table_name).map_fd))
+        except KeyError:
+            continue
+    for func_name, func in program.funcs.items():
+        pins.append((f"prog_{func_name}", func.fd))
+
+    # Results that are not pinned are lost with the collector, that's a no go
+    for i, (pin_name, fd) in enumerate(pins):
+        pin = os.path.join(path, pin_name)
+        if libbcc.lib.bpf_obj_pin(fd, pin.encode("utf-8")) != 0:
+            for done, _ in pins[:i]:
+                os.unlink(os.path.join(path, done))
+            os.rmdir(path)
+            sys.exit(f"Could not pin {pin_name} to {pin}")
+    print(f"Pinned {len(pins)} tables and programs to {path}")
+    return path
+
+
+def collect_sched(program, ranks):
+    """
+    Collect off-CPU time by reason and run queue latency per process.
+
+    The histogram buckets are [low, high, count] in usecs, the same
+    log2 buckets that bcc prints.
+    """
+    reasons = {0: "preempted", 1: "blocked"}
+    processes = {}
+
+    def get_process(tgid):
+        if tgid not in processes:
+            processes[tgid] = {"tgid": tgid, "rank": ranks.get(tgid)}
+            for reason in reasons.values():
+                processes[tgid][f"{reason}_count"] = 0
+                processes[tgid][f"{reason}_nsecs"] = 0
+            processes[tgid]["runq_count"] = 0
+            processes[tgid]["runq_nsecs"] = 0
+            processes[tgid]["runq_hist_usecs"] = []
+        return processes[tgid]
+
+    for k, v in program.get_table("offcpu").items():
+        process = get_process(k.tgid)
+        process[f"{reasons[k.reason]}_count"] += v.freq
+        process[f"{reasons[k.reason]}_nsecs"] += v.time
+
+    for k, v in program.get_table("runq_total").items():
+        process = get_process(k.value)
+        process["runq_count"] = v.freq
+        process["runq_nsecs"] = v.time
+
+    for k, v in program.get_table("runq").items():
+        low = (1 << k.slot) if k.slot else 0
+        high = (1 << (k.slot + 1)) - 1
+        get_process(k.tgid)["runq_hist_usecs"].append([low, high, v.value])
+
+    for process in processes.values():
+        process["runq_hist_usecs"].sort()
+    return list(processes.values())
+
+
+def load_program(args, pid, functions):
+    """
+    Build, load and attach the ebpf program for the modes we asked for.
+
+    Compiling and attaching (a big --pattern) can take a while, so this runs
+    off the event loop and the application output keeps flowing.
+    """
+    # The raw tracepoints attach when the program is loaded
+    program_text = bpf_text
+    if args.syscalls:
+        program_text += syscall_text
+    if args.sched:
+        program_text += sched_text
+    if args.mpi:
+        program_text += get_mpi_text(functions)
+    if args.startup:
+        program_text += startup_text
+    if args.image:
+        program_text += image_text
+    if args.vfs:
+        program_text += vfs_text
+    if args.isolation:
+        program_text += get_isolation_text()
+    if args.poll:
+        program_text += poll_text
+    if args.memory:
+        program_text += memory_text
+    if args.contention:
+        program_text += contention_text
+    if args.interference:
+        program_text += interference_text
+
+    # Modes on the syscall tracepoints share one handler (see syscall_modes)
+    cflags = [
+        f"-D{define}" for mode, define in syscall_modes.items() if getattr(args, mode)
+    ]
+    if cflags:
+        program_text += syscall_dispatch_text
+    program = BPF(text=program_text, cflags=cflags)
+    add_filter(program, pid)
+    if args.image:
+        setup_images(program, args.image)
+
+    # Map of tgid to MPI rank, looked up when we first see a process
+    ranks = {}
+
+    def record_rank(tgid):
+        if ranks.get(tgid) is None:
+            ranks[tgid] = get_rank(tgid)
+
+    # Pids that exec'd since the last poll, their libraries are new
+    execs = set()
+
+    def handle_exec(cpu, data, size):
+        tgid = program["execs"].event(data).tgid
+        record_rank(tgid)
+        execs.add(tgid)
+
+    for tgid in [pid] + get_children(pid):
+        record_rank(tgid)
+    program["execs"].open_perf_buffer(handle_exec)
+
+    # Startup events come in while the program is running
+    startup_events = []
+
+    def handle_startup(cpu, data, size):
+        event = program["startup_events"].event(data)
+        startup_events.append(
+            {
+                "tgid": event.tgid,
+                "type": event.type,
+                "nr": event.nr,
+                "ret": event.ret,
+                "ts": event.ts,
+                "delta": event.delta,
+                "path": event.path.decode("utf-8", errors="replace"),
+            }
+        )
+
+    def handle_startup_lost(count):
+        print(f"Warning: lost {count} startup events.")
+
+    if args.startup:
+        setup_startup(program)
+        program["startup_events"].open_perf_buffer(
+            handle_startup, page_cnt=256, lost_cb=handle_startup_lost
+        )
+
+    if args.syscalls:
+        print("Timing all syscalls with raw tracepoints")
+
+    if args.vfs:
+        for op in vfs_operations:
+            program.attach_kprobe(event=f"vfs_{op}", fn_name=f"vfs_{op}_entry")
+            program.attach_kretprobe(event=f"vfs_{op}", fn_name=f"vfs_{op}_return")
+        print("Timing vfs_read, vfs_write and vfs_open per filesystem")
+
+    isolation_probed = None
+    if args.isolation:
+        isolation_probed = attach_isolation(program)
+
+    if args.poll:
+        setup_poll(program)
+        print("Timing poll, select and epoll waits")
+
+    if args.memory:
+        setup_memory(program)
+        print("Timing page faults and memory syscalls")
+
+    if args.interference:
+        setup_interference(program)
+        print("Counting migrations, interrupts and ticks")
+
+    # patterns should be regular expression oriented
+    if args.pattern:
+        program.attach_kprobe(event_re=args.pattern, fn_name="start_timing")
+        program.attach_kretprobe(event_re=args.pattern, fn_name="stop_timing")
+
+        # This tells us the number of kprobes we match
+        matched = program.num_open_kprobes()
+
+        # We got a bad, bad pattern!
+        if matched == 0:
+            sys.exit(f'0 functions matched by "{args.pattern}". Exiting.')
+
+        # We have to divide by two since we have a start/stop
+        number_functions = int(matched / 2)
+        print(f'Timing {number_functions} functions for "{args.pattern}')
+
+    if args.pin:
+        pin_program(program, args.pin)
+
+    return {
+        "program": program,
+        "ranks": ranks,
+        "execs": execs,
+        "startup_events": startup_events,
+        "isolation_probed": isolation_probed,
+    }
+
+
+def get_totals(program, functions, ranks, mpi=False, isolation=False):
+    """
+    Get function times from the tables, per function and per rank.
+
+    This is used for the final results and for snapshots while running.
+    """
+    totals = {}
+    per_rank = []
+
+    def add_row(func, tgid, v):
+        rank = ranks.get(tgid)
+        per_rank.append(
+            {
+                "func": func,
+                "tgid": tgid,
+                "rank": rank,
+                "count": v.freq,
+                "time_nsecs": v.time,
+            }
+        )
+        if func not in totals:
+            totals[func] = {
+                "func": func,
+                "count": 0,
+                "time_nsecs": 0,
+                "non_rank_time_nsecs": 0,
+                "times": {},
+            }
+        total = totals[func]
+        total["count"] += v.freq
+        total["time_nsecs"] += v.time
+
+        # Launchers (mpirun, prted, the shell, the starter) are not ranks,
+        # and a rank can be more than one process (e.g., exec of a wrapper)
+        if rank is None:
+            total["non_rank_time_nsecs"] += v.time
+        else:
+            total["times"][rank] = total["times"].get(rank, 0) + v.time
+
+    for k, v in program.get_table("stats").items():
+        add_row(BPF.sym(k.ip, -1).decode("utf-8"), k.tgid, v)
+
+    # MPI functions go in the same table
+    if mpi:
+        for k, v in program.get_table("mpi_stats").items():
+            add_row(functions[k.id], k.tgid, v)
+
+    # And so do the isolation hooks (outermost calls only), named like
+    # isolation:<func> since --pattern can time the same function
+    if isolation:
+        for k, v in program.get_table("iso_stats").items():
+            add_row(f"isolation:{BPF.sym(k.ip, -1).decode('utf-8')}", k.tgid, v)
+    return totals, per_rank
+
+
+def write_snapshot(filename, program, functions, ranks, args, started):
+    """
+    Write function totals so far, replacing the last snapshot.
+
+    We write to a temporary file and rename so a reader never sees half a file.
+    """
+    totals, _ = get_totals(program, functions, ranks, args.mpi, args.isolation)
+    results = []
+    for total in totals.values():
+        total["per_rank"] = summarize_ranks(list(total.pop("times").values()))
+        results.append(total)
+    if args.syscalls:
+        results += collect_syscalls(program)
+    snapshot = {"elapsed_seconds": time.time() - started, "results": results}
+    tmp = f"{filename}.tmp"
+    with open(tmp, "w") as fd:
+        fd.write(json.dumps(snapshot))
+    os.replace(tmp, filename)
+
+
+def get_log(log_dir, name, max_bytes, backups):
+    """
+    Get a rotating log for one application stream (e.g., app-stdout.log)
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, f"app-{name}.log"),
+        maxBytes=max_bytes,
+        backupCount=backups,
+    )
+    # We write the output as is, without a newline or prefix
+    handler.terminator = ""
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log = logging.getLogger(f"time-calls.{name}")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(handler)
+    return log
+
+
+async def stream_output(stream, echo=None, log=None, tail=None, chunk=65536):
+    """
+    Stream application output to the terminal and a log as it comes.
+
+    We read chunks (not lines) so a huge line cannot trip the reader, and we only
+    keep the tail, so memory stays flat no matter how chatty the run is.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = await stream.read(chunk)
+        text = decoder.decode(data, final=not data)
+        if text:
+            if echo is not None:
+                echo.write(text)
+                echo.flush()
+            if log is not None:
+                log.info(text)
+            if tail is not None:
+                tail.append(text)
+        if not data:
+            return
+
+
+def signal_group(p, signum):
+    """
+    Signal the application and its children (the process group).
+    """
+    try:
+        os.killpg(p.pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def exited(p, pid):
+    """
+    Determine if the application is done.
+
+    We don't await p.wait(), it also waits for the pipes to close and children
+    (e.g., orphaned ranks) can hold them open after the application exits.
+    """
+    if p is not None:
+        return p.returncode is not None
+    return not pid_exists(pid)
+
+
+async def run(args, command, functions):
+    """
+    Run (or watch) the application and poll the ebpf program until it is done.
+
+    Output is streamed while the application runs, the perf buffers (and
+    snapshots) are polled on a schedule, and SIGINT, SIGTERM or --timeout stop
+    the application so we can still write the results.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.time()
+
+    # NOTE: this does add some overhead to the application, but it depends how you run it
+    # By process (e.g., wrapping lmp and not mpirun) adds a few seconds vs. mpirun
+    # is comparable
+    p = None
+    readers = []
+    logs = []
+    tail = collections.deque(maxlen=64)
+    if args.pid is None and command:
+        # A new session, so we can stop the application and its children together
+        p = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        pid = p.pid
+        for name, stream, echo, keep in [
+            ("stdout", p.stdout, sys.stdout, None),
+            ("stderr", p.stderr, sys.stderr, tail),
+        ]:
+            log = None
+            if args.log_dir:
+                log = get_log(args.log_dir, name, args.log_max_bytes, args.log_backups)
+                logs.append(log)
+            echo = None if args.quiet else echo
+            readers.append(asyncio.create_task(stream_output(stream, echo, log, keep)))
+    else:
+        pid = args.pid
+
+    print(f"👀️ Watching pid {pid}...")
+
+    # A signal or timeout asks us to stop, we keep the first reason
+    stop = asyncio.Event()
+    reasons = []
+
+    def request_stop(reason):
+        reasons.append(reason)
+        stop.set()
+
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(signum, request_stop, signal.Signals(signum).name)
+    if args.timeout:
+        loop.call_later(args.timeout, request_stop, f"timeout of {args.timeout}s")
+
+    try:
+        state = await loop.run_in_executor(None, load_program, args, pid, functions)
+    except (Exception, SystemExit):
+        if p is not None and p.returncode is None:
+            p.kill()
+            await p.wait()
+        raise
+    program = state["program"]
+
+    # Poll for exec events (to get ranks) until the program finishes
+    # We look for new MPI libraries here too, since they are only mapped
+    # after a rank starts (calls before we attach are missed).
+    # A pid is scanned a poll after it appears (or execs) so the loader has
+    # mapped its libraries. Without MPI we scan it again every so often
+    # (a launcher, or MPI from dlopen) until it has MPI or it's gone.
+    mpi_attached = {}
+    mpi_pids = set()
+    mpi_scanned = {}
+    mpi_gone = set()
+    mpi_ready = set()
+    last_snapshot = time.time()
+    while not stop.is_set():
+        program.perf_buffer_poll(timeout=0)
+        if args.mpi:
+            now = time.time()
+            pids = [
+                x
+                for x in mpi_ready
+                if x not in mpi_pids
+                and now - mpi_scanned.get(x, 0) >= mpi_rescan_interval
+            ]
+            mpi_pids |= attach_mpi(program, functions, pids, mpi_attached)
+            for x in pids:
+                if x in mpi_pids:
+                    continue
+                if os.path.exists(f"/proc/{x}"):
+                    mpi_scanned[x] = now
+                else:
+                    mpi_gone.add(x)
+
+            # An exec maps new libraries (e.g., the starter becomes the app)
+            for x in state["execs"]:
+                mpi_pids.discard(x)
+                mpi_scanned.pop(x, None)
+            state["execs"].clear()
+            mpi_ready = set(state["ranks"]) - mpi_gone
+        if args.snapshot and time.time() - last_snapshot >= args.snapshot_interval:
+            write_snapshot(
+                args.snapshot, program, functions, state["ranks"], args, started
+            )
+            last_snapshot = time.time()
+        if exited(p, pid):
+            break
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=args.interval)
+        except asyncio.TimeoutError:
+            pass
+
+    # We were asked to stop, but only stop the application if we started it
+    if reasons:
+        print(f"Stopping early ({reasons[0]}).")
+        if p is not None and p.returncode is None:
+            signal_group(p, signal.SIGTERM)
+            deadline = time.time() + args.grace
+            while p.returncode is None and time.time() < deadline:
+                await asyncio.sleep(args.interval)
+            if p.returncode is None:
+                print(f"Application did not exit after {args.grace}s, killing it.")
+                signal_group(p, signal.SIGKILL)
+                while p.returncode is None:
+                    await asyncio.sleep(args.interval)
+
+    # Get any events that are left
+    program.perf_buffer_poll(timeout=0)
+
+    # Children (e.g., orphaned ranks) can hold the pipes open after the
+    # application exits, so we give them a moment and then clean them up
+    if readers:
+        done, pending = await asyncio.wait(readers, timeout=5)
+        if pending:
+            print("Application children are still running, killing them.")
+            signal_group(p, signal.SIGKILL)
+            done, pending = await asyncio.wait(pending, timeout=5)
+        for reader in pending:
+            reader.cancel()
+    for log in logs:
+        for handler in log.handlers:
+            handler.close()
+
+    # Print output - for the experiments we will save it to file
+    # Better would be to open an sqlite database, and save to a table
+    # based on the program, pid, and iteration.
+    if p is not None:
+        if p.returncode == 0:
+            print("Run was successful.")
+        else:
+            # The application errors are in the .out too
+            print("".join(tail))
+            print("Run was not successful.")
+
+    if args.snapshot:
+        write_snapshot(args.snapshot, program, functions, state["ranks"], args, started)
+
+    state["mpi_attached"] = mpi_attached
+    return state
+
+
+def main():
+    """
+    Run the ebpf program. Usage:
+
+    sudo -E python3 time-calls.py sleep 10
+    """
+    parser = get_parser()
+    args, command = parser.parse_known_args()
+
+    # If we don't have a command or pid, no go
+    if not command and not args.pid:
+        sys.exit("We need a --pid or command to follow the script, bro-shizzle.")
+
+    # Check before we start anything, pin_program checks again
+    if args.pin and os.path.exists(os.path.join(pin_root, args.pin)):
+        sys.exit(
+            f"{os.path.join(pin_root, args.pin)} exists from an earlier run, "
+            f"remove it with read-pinned.py remove {args.pin}"
+        )
+
+    # Syscall mode replaces the do_sys* kprobes unless we ask for a pattern too
+    if args.pattern is None and not args.syscalls:
+        args.pattern = "do_sys*"
+
+    # Run (or watch) the application, and collect until it is done
+    functions = mpi_functions
+    if args.mpi_functions:
+        functions = args.mpi_functions.split(",")
+    state = asyncio.run(run(args, command, functions))
+    program = state["program"]
+    ranks = state["ranks"]
+    mpi_attached = state["mpi_attached"]
+
+    # Get a table from the program, and aggregate per function and per rank
+    totals, per_rank = get_totals(program, functions, ranks, args.mpi, args.isolation)
+
+    print()
+    print(
+        "%-36s %8s %16s %6s %16s %16s"
+        % ("FUNC", "COUNT", "TIME (nsecs)", "RANKS", "MIN", "MAX")
+    )
+    results = []
+    for func, total in totals.items():
+        total["per_rank"] = summarize_ranks(list(total.pop("times").values()))
+        results.append(total)
+        summary = total["per_rank"] or {"n": 0, "min": "-", "max": "-"}
+        print(
+            "%-36s %8s %16s %6s %16s %16s"
+            % (
+                func,
+                total["count"],
+                total["time_nsecs"],
+                summary["n"],
+                summary["min"],
+                summary["max"],
+            )
+        )
+
+    # Syscalls go in the same table, named syscall:<name>
+    if args.syscalls:
+        syscalls = collect_syscalls(program)
+        for result in syscalls:
+            print(
+                "%-36s %8s %16s"
+                % (result["func"], result["count"], result["time_nsecs"])
+            )
+        results += syscalls
+
+    # Results are totals (one per function) so the format does not change
+    print_block("RESULTS", results)
+
+    # And the per-rank breakdown, one row per (tgid, function)
+    print_block("RANKS", per_rank)
+
+    # The MPI library each rank used (host or container path)
+    if args.mpi:
+        libraries = []
+        for library in mpi_attached.values():
+            for tgid in library["pids"]:
+                libraries.append(
+                    {
+                        "tgid": tgid,
+                        "rank": ranks.get(tgid),
+                        "library": library["path"],
+                        "functions": library["functions"],
+                    }
+                )
+        print_block("MPI", libraries)
+
+    # Interference per rank (and per CPU in the block)
+    if args.interference:
+        interference = collect_interference(program, ranks)
+        print()
+        print(
+            "%-8s %6s %10s %10s %16s %10s %16s %10s"
+            % (
+                "TGID",
+                "RANK",
+                "MIGRATE",
+                "IRQS",
+                "IRQ (nsecs)",
+                "SOFTIRQS",
+                "SOFTIRQ (nsecs)",
+                "TICKS",
+            )
+        )
+        for row in interference["ranks"]:
+            print(
+                "%-8s %6s %10s %10s %16s %10s %16s %10s"
+                % tuple(
+                    [row["tgid"], row["rank"]]
+                    + [row[field] for field in interference_fields]
+                )
+            )
+        print_block("INTERFERENCE", interference)
+
+    # Lock contention by lock and caller, the top 20 for the terminal
+    if args.contention:
+        contention = collect_contention(program)
+        print()
+        print(
+            "%-20s %-24s %-32s %10s %16s"
+            % ("LOCK", "KIND", "CALLER", "COUNT", "WAIT (nsecs)")
+        )
+        for row in contention["locks"][:20]:
+            lock = (
+                row["lock"] if row["lock_symbol"] == "[unknown]" else row["lock_symbol"]
+            )
+            print(
+                "%-20s %-24s %-32s %10s %16s"
+                % (lock, row["kind"], row["caller"], row["count"], row["time_nsecs"])
+            )
+        print_block("CONTENTION", contention)
+
+    # Page faults and memory syscalls per rank
+    if args.memory:
+        memory = collect_memory(program, ranks)
+        summary = {}
+        for process in memory["ranks"]:
+            for name, values in list(process["faults"].items()) + list(
+                process["syscalls"].items()
+            ):
+                if name not in summary:
+                    summary[name] = [0, 0]
+                summary[name][0] += values["count"]
+                summary[name][1] += values["time_nsecs"]
+        print()
+        print("%-16s %12s %16s" % ("FAULT/SYSCALL", "COUNT", "TIME (nsecs)"))
+        for name, (count, total) in summary.items():
+            print("%-16s %12s %16s" % (name, count, total))
+        print_block("MEMORY", memory)
+
+    # Poll waits by fd type and outcome, summed across ranks for the terminal
+    if args.poll:
+        poll = collect_poll(program, ranks)
+        summary = {}
+        for row in poll:
+            key = (row["syscall"], row["fd_types"], row["outcome"])
+            if key not in summary:
+                summary[key] = [0, 0]
+            summary[key][0] += row["count"]
+            summary[key][1] += row["time_nsecs"]
+        print()
+        print(
+            "%-14s %-24s %-12s %10s %16s"
+            % ("SYSCALL", "FD TYPES", "OUTCOME", "COUNT", "TIME (nsecs)")
+        )
+        for (syscall, types, outcome), (count, total) in summary.items():
+            print(
+                "%-14s %-24s %-12s %10s %16s" % (syscall, types, outcome, count, total)
+            )
+        print_block("POLL", poll)
+
+    # Isolation cost per mechanism, e.g., X nsecs per syscall in seccomp
+    if args.isolation:
+        isolation = collect_isolation(program, state["isolation_probed"])
+        print()
+        print(
+            "%-12s %10s %12s %16s %12s"
+            % ("MECHANISM", "FUNCTIONS", "COUNT", "TIME (nsecs)", "NS/SYSCALL")
+        )
+        for row in isolation:
+            print(
+                "%-12s %10s %12s %16s %12.2f"
+                % (
+                    row["mechanism"],
+                    row["functions_probed"],
+                    row["count"],
+                    row["time_nsecs"],
+                    row["nsecs_per_syscall"],
+                )
+            )
+        print_block("ISOLATION", isolation)
+
+    # VFS latency per filesystem type
+    if args.vfs:
+        vfs = collect_vfs(program)
+        print()
+        print(
+            "%-16s %-8s %12s %16s %12s"
+            % ("FILESYSTEM", "OP", "COUNT", "TIME (nsecs)", "MEAN (nsecs)")
+        )
+        for row in vfs:
+            mean = int(row["time_nsecs"] / row["count"]) if row["count"] else 0
+            print(
+                "%-16s %-8s %12s %16s %12s"
+                % (
+                    row["filesystem"],
+                    row["operation"],
+                    row["count"],
+                    row["time_nsecs"],
+                    mean,
+                )
+            )
+        print_block("VFS", vfs)
+
+    # Pages read from container images, and a manifest to prefetch them
+    if args.image:
+        images = collect_images(program, args.image, ranks)
+        for image in images:
+            print(
+                f"Read {image['pages']} pages ({len(image['ranges'])} ranges) from {image['image']}"
+            )
+        print_block("IMAGES", images)
+        if args.manifest:
+            with open(args.manifest, "w") as fd:
+                fd.write(json.dumps(images, indent=4))
+            print(f"Wrote prefetch manifest to {args.manifest}")
+
+    # Startup time per rank, and the cost per library
+    if args.startup:
+        startup, libraries = summarize_startup(state["startup_events"], ranks)
+        print()
+        print(
+            "%-36s %6s %8s %16s %16s"
+            % ("LIBRARY", "RANKS", "LOOKUPS", "LOOKUP (nsecs)", "LOAD (nsecs)")
+        )
+        for row in libraries:
+            print(
+                "%-36s %6s %8s %16s %16s"
+                % (
+                    row["library"],
+                    row["ranks"],
+                    row["lookup_count"],
+                    row["lookup_nsecs"],
+                    row["load_nsecs"],
+                )
+            )
+        print_block("STARTUP", startup)
+        print_block("LIBRARIES", libraries)
+
+    # Scheduler stats, one row per process (rank)
+    if args.sched:
+        sched = collect_sched(program, ranks)
+        print()
+        print(
+            "%-8s %6s %16s %16s %16s"
+            % ("TGID", "RANK", "BLOCKED (nsecs)", "PREEMPTED (nsecs)", "RUNQ (nsecs)")
         )
-        print("%-36s %8s %16s" % (BPF.sym(k.value, -1).decode("utf-8"), v.freq, v.time))
-    print("\n=== RESULTS START")
-    print(json.dumps(results))
-    print("=== RESULTS END")
+        for row in sched:
+            print(
+                "%-8s %6s %16s %16s %16s"
+                % (
+                    row["tgid"],
+                    row["rank"],
+                    row["blocked_nsecs"],
+                    row["preempted_nsecs"],
+                    row["runq_nsecs"],
+                )
+            )
+        print_block("SCHED", sched)
 
     # This only works for one function
     # program.detach_kprobe(event_re=pattern, fn_name="start_timing")